@@ -40,4 +40,167 @@ CREATE TABLE game(
 	FOREIGN KEY(offense_b) REFERENCES player(id)
 );
 
-CREATE INDEX game_season_idx ON game(timestamp, season)
+-- queries are scoped to an org, so its games are next to each other in the index
+CREATE INDEX game_org_idx ON game(org, season, timestamp);
+
+-- one row per player and game, derived from the game table by the triggers below, so queries for
+-- the games of a player can use an index instead of checking all four player columns of every game
+-- role is 'both' if a player plays alone (1v1)
+CREATE TABLE game_player(
+	org       TEXT NOT NULL,
+	game_id   TEXT NOT NULL,
+	player    TEXT NOT NULL,
+	team      TEXT NOT NULL CHECK(team IN ('a', 'b')),
+	role      TEXT NOT NULL CHECK(role IN ('defense', 'offense', 'both')),
+	timestamp NUMERIC NOT NULL,
+	season    TEXT NOT NULL,
+
+	PRIMARY KEY(game_id, player),
+	FOREIGN KEY(org) REFERENCES org(id),
+	FOREIGN KEY(player) REFERENCES player(id)
+) WITHOUT ROWID;
+
+-- players belong to a single org, so this index is partitioned by org as well
+CREATE INDEX game_player_player_idx ON game_player(player, season, timestamp);
+CREATE INDEX game_player_org_idx ON game_player(org, season, timestamp);
+
+CREATE TRIGGER game_player_insert AFTER INSERT ON game BEGIN
+	INSERT INTO game_player
+	SELECT NEW.org, NEW.id, NEW.defense_a, 'a', iif(NEW.defense_a = NEW.offense_a, 'both', 'defense'), NEW.timestamp, NEW.season
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.offense_a, 'a', 'offense', NEW.timestamp, NEW.season WHERE NEW.offense_a != NEW.defense_a
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.defense_b, 'b', iif(NEW.defense_b = NEW.offense_b, 'both', 'defense'), NEW.timestamp, NEW.season
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.offense_b, 'b', 'offense', NEW.timestamp, NEW.season WHERE NEW.offense_b != NEW.defense_b;
+END;
+
+CREATE TRIGGER game_player_delete AFTER DELETE ON game BEGIN
+	DELETE FROM game_player WHERE game_id = OLD.id;
+END;
+
+CREATE TRIGGER game_player_update AFTER UPDATE ON game BEGIN
+	DELETE FROM game_player WHERE game_id = OLD.id;
+	INSERT INTO game_player
+	SELECT NEW.org, NEW.id, NEW.defense_a, 'a', iif(NEW.defense_a = NEW.offense_a, 'both', 'defense'), NEW.timestamp, NEW.season
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.offense_a, 'a', 'offense', NEW.timestamp, NEW.season WHERE NEW.offense_a != NEW.defense_a
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.defense_b, 'b', iif(NEW.defense_b = NEW.offense_b, 'both', 'defense'), NEW.timestamp, NEW.season
+	UNION ALL
+	SELECT NEW.org, NEW.id, NEW.offense_b, 'b', 'offense', NEW.timestamp, NEW.season WHERE NEW.offense_b != NEW.defense_b;
+END;
+
+-- counter per season bumped on every change of its games, used to tell whether cached games of
+-- the season are still up to date (see wuzzln.database.query_season_games)
+CREATE TABLE game_version(
+	org     TEXT NOT NULL,
+	season  TEXT NOT NULL,
+	version INT NOT NULL,
+
+	PRIMARY KEY(org, season)
+) WITHOUT ROWID;
+
+CREATE TRIGGER game_version_insert AFTER INSERT ON game BEGIN
+	INSERT INTO game_version VALUES (NEW.org, NEW.season, 1)
+	ON CONFLICT(org, season) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER game_version_delete AFTER DELETE ON game BEGIN
+	INSERT INTO game_version VALUES (OLD.org, OLD.season, 1)
+	ON CONFLICT(org, season) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER game_version_update AFTER UPDATE ON game BEGIN
+	INSERT INTO game_version VALUES (OLD.org, OLD.season, 1)
+	ON CONFLICT(org, season) DO UPDATE SET version = version + 1;
+	INSERT INTO game_version VALUES (NEW.org, NEW.season, 1)
+	ON CONFLICT(org, season) DO UPDATE SET version = version + 1;
+END;
+
+-- rating after each game, derived from the game table (see wuzzln.database.rebuild_ratings)
+CREATE TABLE rating(
+	org           TEXT NOT NULL,
+	season        TEXT NOT NULL,
+	player        TEXT NOT NULL,
+	timestamp     NUMERIC NOT NULL,
+
+	overall       REAL NOT NULL,
+	defense       REAL NOT NULL,
+	defense_mu    REAL NOT NULL,
+	defense_sigma REAL NOT NULL,
+	offense       REAL NOT NULL,
+	offense_mu    REAL NOT NULL,
+	offense_sigma REAL NOT NULL,
+
+	FOREIGN KEY(org) REFERENCES org(id),
+	FOREIGN KEY(player) REFERENCES player(id)
+);
+
+CREATE INDEX rating_player_idx ON rating(org, season, player, timestamp);
+CREATE INDEX rating_timestamp_idx ON rating(org, season, timestamp);
+
+-- latest rating of every player after every n-th game of a season, used to look up ratings at
+-- any point in time without reading the whole season (see wuzzln.database.query_latest_rating)
+CREATE TABLE rating_checkpoint(
+	org           TEXT NOT NULL,
+	checkpoint    NUMERIC NOT NULL, -- timestamp of the game after which the checkpoint was taken
+
+	season        TEXT NOT NULL,
+	player        TEXT NOT NULL,
+	timestamp     NUMERIC NOT NULL,
+
+	overall       REAL NOT NULL,
+	defense       REAL NOT NULL,
+	defense_mu    REAL NOT NULL,
+	defense_sigma REAL NOT NULL,
+	offense       REAL NOT NULL,
+	offense_mu    REAL NOT NULL,
+	offense_sigma REAL NOT NULL,
+
+	FOREIGN KEY(org) REFERENCES org(id),
+	FOREIGN KEY(player) REFERENCES player(id)
+);
+
+CREATE INDEX rating_checkpoint_idx ON rating_checkpoint(org, season, checkpoint);
+
+-- statistics of each player per season, derived from the game table (see wuzzln.database.insert_stats)
+CREATE TABLE player_stats(
+	org              TEXT NOT NULL,
+	season           TEXT NOT NULL,
+	player           TEXT NOT NULL,
+
+	prior_game_count INT NOT NULL, -- games played before the season
+	game_count       INT NOT NULL,
+	one_vs_one_count INT NOT NULL,
+	zero_win_count   INT NOT NULL,
+	zero_loss_count  INT NOT NULL,
+	win_streak       INT NOT NULL, -- won games in a row, reset by a loss
+	loss_streak      INT NOT NULL,
+	people_count     INT NOT NULL, -- different people played with or against, including oneself
+
+	PRIMARY KEY(org, season, player),
+	FOREIGN KEY(org) REFERENCES org(id),
+	FOREIGN KEY(player) REFERENCES player(id)
+) WITHOUT ROWID;
+
+-- recently suggested matchups shown on the add game page, expired ones are deleted on insert
+CREATE TABLE matchmaking(
+	org               TEXT NOT NULL,
+	timestamp         NUMERIC NOT NULL,
+	defense_a         TEXT NOT NULL,
+	offense_a         TEXT NOT NULL,
+	defense_b         TEXT NOT NULL,
+	offense_b         TEXT NOT NULL,
+	win_probability_a REAL NOT NULL,
+	win_probability_b REAL NOT NULL,
+
+	UNIQUE(defense_a, offense_a, defense_b, offense_b),
+	FOREIGN KEY(org) REFERENCES org(id),
+	FOREIGN KEY(defense_a) REFERENCES player(id),
+	FOREIGN KEY(offense_a) REFERENCES player(id),
+	FOREIGN KEY(defense_b) REFERENCES player(id),
+	FOREIGN KEY(offense_b) REFERENCES player(id)
+);
+
+CREATE INDEX matchmaking_timestamp_idx ON matchmaking(org, timestamp);
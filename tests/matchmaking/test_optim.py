@@ -1,14 +1,26 @@
 import random
-from itertools import combinations
+import time
+from itertools import combinations, permutations
 from typing import Sequence
 
+import pytest
 import trueskill as ts
 
+from wuzzln.executor import shutdown_executor
 from wuzzln.matchmaking import (
+    EXACT_SEARCH_MAX_PLAYERS,
+    DrawProbabilityMatrix,
+    Team,
+    as_teams,
+    draw_probability,
+    exact_search,
+    fitness,
+    matching_search,
+    multi_start_tabu_search,
+    partner_penalty,
     swap_two_players_neighborhood,
     tabu_search,
     variety_2v2,
-    win_probability,
 )
 
 
@@ -89,19 +101,117 @@ def test_tabu_search_ordered_solution():
         defense = as_rating([random.randrange(0, 30) for _ in range(8)])
         offense = as_rating([random.randrange(0, 30) for _ in range(8)])
 
-        avg_devs = []
+        fitness = []
         for teams in tabu_search(defense, offense, k=4, max_iter=500):
-            devs = []
+            draw_probs = []
             for team_a, team_b in combinations(sorted(teams), 2):
                 team_a = (defense[team_a[0]], offense[team_a[1]])
                 team_b = (defense[team_b[0]], offense[team_b[1]])
-                fair_dev = abs(0.5 - win_probability(team_a, team_b))
-                devs.append(fair_dev)
-            avg_devs.append(sum(devs) / len(devs))
+                draw_probs.append(draw_probability(team_a, team_b) ** 2)
+            fitness.append(sum(draw_probs))
 
         # k is not exact at the moment
-        assert 1 < len(avg_devs) <= 4
-        assert sorted(avg_devs) == avg_devs
+        assert 1 < len(fitness) <= 4
+        assert sorted(fitness, reverse=True) == fitness
+
+
+def test_tabu_search_stops_at_deadline():
+    random.seed(389)
+    defense = as_rating([random.randrange(0, 30) for _ in range(20)])
+    offense = as_rating([random.randrange(0, 30) for _ in range(20)])
+    start = time.time()
+    solutions = tabu_search(defense, offense, max_iter=10**9, deadline=start + 0.2)
+    assert time.time() - start < 1
+    assert len(solutions) >= 1
+
+
+def test_multi_start_tabu_search():
+    random.seed(389)
+    defense = as_rating([random.randrange(0, 30) for _ in range(12)])
+    offense = as_rating([random.randrange(0, 30) for _ in range(12)])
+
+    start = time.time()
+    solutions = multi_start_tabu_search(defense, offense, k=3, time_budget=0.5, starts=3)
+    assert time.time() - start < 2
+    # stops the shared pool and its thread, other tests fork this process
+    shutdown_executor()
+
+    fitness = []
+    for teams in solutions:
+        assert sorted(p for team in teams for p in team) == list(range(12))
+        fitness.append(
+            sum(
+                draw_probability((defense[a[0]], offense[a[1]]), (defense[b[0]], offense[b[1]]))
+                ** 2
+                for a, b in combinations(teams, 2)
+            )
+        )
+    assert len(solutions) == 3
+    assert sorted(fitness, reverse=True) == fitness
+
+
+def test_partner_penalty_avoids_common_partners():
+    random.seed(389)
+    for n in 6, 12:
+        defense = as_rating([20] * n)
+        offense = as_rating([20] * n)
+        penalty = partner_penalty({(0, 1): 5, (3, 2): 1}, n)
+        solutions = [tabu_search(defense, offense, max_iter=100, penalty=penalty)[0]]
+        if n <= EXACT_SEARCH_MAX_PLAYERS:
+            solutions.append(exact_search(defense, offense, penalty=penalty)[0])
+        for teams in solutions:
+            assert not {(0, 1), (1, 0), (2, 3), (3, 2)} & teams
+
+
+def test_tabu_search_with_penalty_finds_exact_solution():
+    random.seed(389)
+    defense = as_rating([random.randrange(0, 30) for _ in range(8)])
+    offense = as_rating([random.randrange(0, 30) for _ in range(8)])
+    partner_count = {
+        (random.randrange(8), random.randrange(8)): random.randrange(5) for _ in range(20)
+    }
+    penalty = partner_penalty(partner_count, 8, weight=0.5)
+
+    draw_prob_sq = DrawProbabilityMatrix(defense, offense)
+    exact = exact_search(defense, offense, penalty=penalty)[0]
+    tabu = tabu_search(defense, offense, max_iter=500, penalty=penalty)[0]
+    assert fitness(draw_prob_sq, [d * 8 + o for d, o in tabu], penalty) == pytest.approx(
+        fitness(draw_prob_sq, [d * 8 + o for d, o in exact], penalty)
+    )
+
+
+def test_matching_search_every_player_once():
+    random.seed(389)
+    for n in 2, 6, 8, 30:
+        defense = as_rating([random.randrange(0, 30) for _ in range(n)], 3)
+        offense = as_rating([random.randrange(0, 30) for _ in range(n)], 3)
+        games = matching_search(defense, offense)
+        teams = {team for game in games for team in game}
+        assert sorted(p for team in teams for p in team) == sorted(
+            range(n) if n > 2 else [0, 0, 1, 1]
+        )
+        # odd number of teams gets an additional game
+        assert len(games) == (len(teams) + 1) // 2
+        assert games == matching_search(defense, offense)
+
+
+def test_matching_search_best_pairing_of_teams():
+    random.seed(389)
+    for _ in range(10):
+        defense = as_rating([random.randrange(0, 30) for _ in range(8)], 3)
+        offense = as_rating([random.randrange(0, 30) for _ in range(8)], 3)
+        games = matching_search(defense, offense)
+
+        def quality(games: list[tuple[Team[int], Team[int]]]) -> float:
+            return sum(
+                draw_probability((defense[a[0]], offense[a[1]]), (defense[b[0]], offense[b[1]]))
+                ** 2
+                for a, b in games
+            )
+
+        t0, t1, t2, t3 = (team for game in games for team in game)
+        pairings = [[(t0, t1), (t2, t3)], [(t0, t2), (t1, t3)], [(t0, t3), (t1, t2)]]
+        assert quality(games) == pytest.approx(max(quality(p) for p in pairings))
 
 
 def test_variety_2v2_skipping_for_less_common():
@@ -113,3 +223,55 @@ def test_variety_2v2_skipping_for_less_common():
 
     teams = variety_2v2(defense, offense, partner_count)
     assert teams & {(0, 3)}
+
+
+def test_draw_probability_equals_quality():
+    random.seed(394)
+    for _ in range(100):
+        defense_a, offense_a = as_rating(
+            [random.uniform(0, 40) for _ in range(2)], random.uniform(0.5, 9)
+        )
+        defense_b, offense_b = as_rating(
+            [random.uniform(0, 40) for _ in range(2)], random.uniform(0.5, 9)
+        )
+        team_a, team_b = (defense_a, offense_a), (defense_b, offense_b)
+        assert abs(draw_probability(team_a, team_b) - ts.quality([team_a, team_b])) < 1e-12
+
+
+def test_draw_probability_matrix():
+    random.seed(394)
+    defense = [ts.Rating(random.uniform(0, 40), random.uniform(0.5, 9)) for _ in range(5)]
+    offense = [ts.Rating(random.uniform(0, 40), random.uniform(0.5, 9)) for _ in range(5)]
+    matrix = DrawProbabilityMatrix(defense, offense)
+    for a, b in permutations(range(25), 2):
+        expected = draw_probability(
+            (defense[a // 5], offense[a % 5]), (defense[b // 5], offense[b % 5])
+        )
+        assert abs(matrix.get(a, b) - expected**2) < 1e-12
+        assert abs(matrix.row(a)[b] - expected**2) < 1e-12
+
+
+def test_exact_search_two_players():
+    assert exact_search(as_rating([2, 3]), as_rating([4, 5]), k=3) == [{(0, 0), (1, 1)}]
+
+
+def test_exact_search_is_optimal():
+    random.seed(389)
+    for n in (4, 6, 8):
+        defense = as_rating([random.randrange(0, 30) for _ in range(n)], sigma=2)
+        offense = as_rating([random.randrange(0, 30) for _ in range(n)], sigma=2)
+
+        def fitness(teams):
+            return sum(
+                draw_probability((defense[a[0]], offense[a[1]]), (defense[b[0]], offense[b[1]]))
+                ** 2
+                for a, b in combinations(sorted(teams), 2)
+            )
+
+        assignments = {frozenset(as_teams(p)) for p in permutations(range(n))}
+        all_fitness = sorted((round(fitness(a), 12) for a in assignments), reverse=True)
+        solutions = exact_search(defense, offense, k=3)
+        assert [round(fitness(s), 12) for s in solutions] == all_fitness[:3]
+        assert solutions == exact_search(defense, offense, k=3)
+        for teams in solutions:
+            assert sorted(p for team in teams for p in team) == list(range(n))
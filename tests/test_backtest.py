@@ -0,0 +1,26 @@
+import math
+
+import pytest
+from test_rating import random_games
+
+from wuzzln.backtest import Parameters, backtest, score_predictions, sweep
+
+
+def test_score_predictions():
+    predictions = [(0.8, True), (0.8, False), (0.3, False), (0.3, False)]
+    log_loss, calibration_error, calibration = score_predictions(predictions, bin_count=2)
+    expected_log_loss = -(math.log(0.8) + math.log(0.2) + 2 * math.log(0.7)) / 4
+    assert log_loss == pytest.approx(expected_log_loss)
+    assert [(c.predicted, c.observed, c.count) for c in calibration] == [
+        (0.3, 0, 2),
+        (0.8, 0.5, 2),
+    ]
+    assert calibration_error == pytest.approx((2 * 0.3 + 2 * 0.3) / 4)
+
+
+def test_sweep_equals_sequential_backtest():
+    games = random_games(100)
+    grid = [Parameters(), Parameters(sigma=5), Parameters(tau=0.5)]
+    results = sweep(games, grid, max_workers=2)
+    expected = sorted((backtest(p, games) for p in grid), key=lambda r: r.log_loss)
+    assert results == expected
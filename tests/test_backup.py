@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from test_rating import random_games
+
+from wuzzln.backup import backup_database, list_snapshots, restore_database
+from wuzzln.database import connect, insert
+
+SCHEMA = Path(__file__).parent.parent / "database" / "create.sql"
+
+
+def test_backup_while_adding_games(tmp_path, monkeypatch):
+    monkeypatch.setattr("wuzzln.database.PATH", str(tmp_path / "db.sqlite"))
+    db = connect(check_same_thread=False)
+    db.executescript(SCHEMA.read_text())
+    db.execute("INSERT INTO org VALUES ('org', 'org', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'org', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    db.commit()
+
+    def add_games():
+        for g in random_games(50):
+            insert(db, g)
+            db.commit()
+
+    writer = threading.Thread(target=add_games)
+    writer.start()
+    snapshots = [backup_database(tmp_path / "backup", keep=2, pages=1, sleep=0) for _ in range(3)]
+    writer.join()
+
+    assert list_snapshots(tmp_path / "backup") == snapshots[1:]
+    snapshot = snapshots[-1]
+    assert snapshot is not None
+    restore_database(snapshot, tmp_path / "restored.sqlite")
+    restored = sqlite3.connect(tmp_path / "restored.sqlite")
+    assert restored.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    game_count = restored.execute("SELECT count(*) FROM game").fetchone()[0]
+    assert 0 <= game_count <= 50
+    # consistent snapshot, triggers kept game_player in sync with game
+    query = "SELECT count(DISTINCT game_id) FROM game_player"
+    assert restored.execute(query).fetchone()[0] == game_count
@@ -0,0 +1,443 @@
+import asyncio
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+import pytest
+from test_rating import random_games
+
+from wuzzln.data import Game, Matchmaking
+from wuzzln.database import (
+    MATCHMAKING_TTL,
+    AsyncConnection,
+    ConnectionPool,
+    archive_seasons,
+    close_databases,
+    connect,
+    insert,
+    insert_matchmakings,
+    insert_ratings,
+    insert_stats,
+    query_latest_rating,
+    query_matchmakings,
+    query_org,
+    query_partner_count,
+    query_player_games,
+    query_previous_rating,
+    query_rating_version,
+    query_season_games,
+    query_stats,
+    rebuild_missing_ratings,
+    rebuild_missing_stats,
+    rebuild_ratings,
+    rebuild_stats,
+    recompute_ratings,
+    season_games_cache,
+)
+from wuzzln.rating import RatingState, compute_ratings, get_latest_rating
+from wuzzln.statistics import StatsState, compute_game_count
+
+SCHEMA = Path(__file__).parent.parent / "database" / "create.sql"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr("wuzzln.database.CHECKPOINT_INTERVAL", 7)
+    db = sqlite3.connect(":memory:")
+    db.executescript(SCHEMA.read_text())
+    db.execute("INSERT INTO org VALUES ('org', 'org', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'org', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    yield db
+    db.close()
+
+
+def add_games(db: sqlite3.Connection, games: Iterable[Game]):
+    for g in games:
+        insert(db, g)
+        insert_ratings(db, g)
+
+
+def game_count(db: sqlite3.Connection, timestamp: float) -> Counter[str]:
+    query = "SELECT player, count(*) FROM game_player WHERE timestamp < ? GROUP BY player"
+    return Counter(dict(db.execute(query, (timestamp,))))
+
+
+def test_insert_ratings_equals_replay(db):
+    games = random_games(60)
+    add_games(db, games)
+    rows = db.execute("SELECT * FROM rating ORDER BY rowid").fetchall()
+    assert rows == [("org", *r) for r in compute_ratings(games)]
+
+
+def test_latest_and_previous_rating(db):
+    games = random_games(60)
+    add_games(db, games)
+    state = RatingState()
+    for g in games:
+        state.update(g)
+    assert query_latest_rating(db, "org", "season") == state.latest
+    assert query_previous_rating(db, "org", state.latest) == state.previous
+    assert query_latest_rating(db, "org", "season", players=["p0"]) == {"p0": state.latest["p0"]}
+
+
+def test_rebuild_after_delete(db):
+    games = random_games(60)
+    add_games(db, games)
+    deleted = games[50]
+    db.execute("DELETE FROM game WHERE id = ?", (deleted.id,))
+    rebuild_ratings(db, "org", deleted.season, since=deleted.timestamp)
+
+    rows = db.execute("SELECT * FROM rating ORDER BY timestamp, rowid").fetchall()
+    assert rows == [("org", *r) for r in compute_ratings(games[:50] + games[51:])]
+
+
+def test_rating_as_of_timestamp(db):
+    games = random_games(60)
+    add_games(db, games)
+    assert db.execute("SELECT count(DISTINCT checkpoint) FROM rating_checkpoint").fetchone()[0] == 8
+    for i in range(0, 61, 3):
+        assert query_latest_rating(db, "org", "season", before=i) == get_latest_rating(games[:i])
+
+
+def test_rating_as_of_timestamp_after_delete(db):
+    games = random_games(60)
+    add_games(db, games)
+    deleted = games[12]
+    db.execute("DELETE FROM game WHERE id = ?", (deleted.id,))
+    rebuild_ratings(db, "org", deleted.season, since=deleted.timestamp)
+    new_game = random_games(1, seed=1)[0]._replace(id="new", timestamp=60)
+    add_games(db, (new_game,))
+
+    games = games[:12] + games[13:] + (new_game,)
+    checkpoints = [
+        row[0] for row in db.execute("SELECT DISTINCT checkpoint FROM rating_checkpoint")
+    ]
+    assert checkpoints == [games[i].timestamp for i in range(6, 60, 7)]
+    for i in range(0, 62, 3):
+        assert query_latest_rating(db, "org", "season", before=i) == get_latest_rating(
+            [g for g in games if g.timestamp < i]
+        )
+
+
+def test_recompute_ratings_in_parallel(db):
+    games = random_games(60)
+    add_games(db, games[:30])
+    add_games(db, (g._replace(season="other") for g in games[30:]))
+    expected_ratings = db.execute("SELECT * FROM rating ORDER BY rowid").fetchall()
+    expected_checkpoints = db.execute("SELECT * FROM rating_checkpoint ORDER BY rowid").fetchall()
+
+    recompute_ratings(db, max_workers=2)
+    ratings = db.execute("SELECT * FROM rating ORDER BY season, timestamp").fetchall()
+    checkpoints = db.execute("SELECT * FROM rating_checkpoint ORDER BY season, rowid").fetchall()
+    assert sorted(ratings) == sorted(expected_ratings)
+    assert checkpoints == sorted(expected_checkpoints, key=lambda row: row[2])
+
+
+def test_partner_count(db):
+    games = random_games(60)
+    add_games(db, games)
+    players = ["p0", "p1", "p2", "p3"]
+    expected = Counter(
+        (d, o)
+        for g in games
+        for d, o in [(g.defense_a, g.offense_a), (g.defense_b, g.offense_b)]
+        if d in players and o in players
+    )
+    assert query_partner_count(db, "org", "season", players) == expected
+    assert query_partner_count(db, "org", "other", players) == Counter()
+
+
+def test_game_player_follows_games(db):
+    games = random_games(60)
+    add_games(db, games)
+    assert game_count(db, 30) == compute_game_count(games[:30])
+    assert query_player_games(db, "p0", "season") == [
+        g for g in games if "p0" in {g.defense_a, g.offense_a, g.defense_b, g.offense_b}
+    ]
+
+    one_vs_one = next(g for g in games if g.defense_a == g.offense_a)
+    query = "SELECT player, team, role FROM game_player WHERE game_id = ? ORDER BY team"
+    assert db.execute(query, (one_vs_one.id,)).fetchall() == [
+        (one_vs_one.defense_a, "a", "both"),
+        (one_vs_one.defense_b, "b", "both"),
+    ]
+
+    db.execute("UPDATE game SET defense_a = 'p7', offense_a = 'p7' WHERE id = ?", (one_vs_one.id,))
+    assert db.execute(query, (one_vs_one.id,)).fetchall() == [
+        ("p7", "a", "both"),
+        (one_vs_one.defense_b, "b", "both"),
+    ]
+
+    db.execute("DELETE FROM game WHERE id = ?", (one_vs_one.id,))
+    assert game_count(db, 60) == compute_game_count(g for g in games if g != one_vs_one)
+
+
+def test_incremental_stats_equal_rebuild(db):
+    games = random_games(60)
+    previous_season = tuple(
+        g._replace(id=f"prev{g.id}", season="previous", timestamp=-1) for g in games
+    )
+    add_games(db, previous_season)
+    rebuild_stats(db, "org", "previous")
+    for g in games:
+        insert(db, g)
+        insert_stats(db, g)
+    incremental = query_stats(db, "org", "season")
+    assert incremental["p0"].prior_game_count == compute_game_count(previous_season)["p0"]
+
+    rebuild_stats(db, "org", "season")
+    assert query_stats(db, "org", "season") == incremental
+
+    db.execute("DELETE FROM game WHERE id = ?", (games[-1].id,))
+    rebuild_stats(db, "org", "season")
+    state = StatsState(prior_game_count=compute_game_count(previous_season))
+    for g in games[:-1]:
+        state.update(g)
+    assert query_stats(db, "org", "season") == state.latest
+
+
+def test_season_games_are_read_again_after_changes(db):
+    season_games_cache.clear()
+    games = random_games(20)
+    add_games(db, games)
+    cached = query_season_games(db, "org", "season")
+    assert cached == games
+    assert query_season_games(db, "org", "season") is cached
+    assert query_season_games(db, "org", "other") == ()
+
+    db.execute("DELETE FROM game WHERE id = ?", (games[-1].id,))
+    assert query_season_games(db, "org", "season") == games[:-1]
+
+    db.execute("UPDATE game SET season = 'other' WHERE id = ?", (games[0].id,))
+    assert query_season_games(db, "org", "season") == games[1:-1]
+    assert query_season_games(db, "org", "other") == (games[0]._replace(season="other"),)
+
+
+def test_rating_version_changes_with_games(db):
+    games = random_games(20)
+    versions = [query_rating_version(db, "org", "season")]
+    add_games(db, games[:10])
+    versions.append(query_rating_version(db, "org", "season"))
+
+    # deleting the latest game and adding another one leaves the same number of ratings
+    db.execute("DELETE FROM game WHERE id = ?", (games[9].id,))
+    rebuild_ratings(db, "org", "season", since=games[9].timestamp)
+    versions.append(query_rating_version(db, "org", "season"))
+    add_games(db, (games[10],))
+    versions.append(query_rating_version(db, "org", "season"))
+
+    assert len(set(versions)) == len(versions)
+    assert query_rating_version(db, "org", "other") == (0, 0)
+
+
+def test_orgs_are_separate(db):
+    assert query_org(db, "localhost") == "org"
+    db.execute("INSERT INTO org VALUES ('other', 'other', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'other', ?, 1)", [(f"q{i}", i) for i in range(8)])
+    assert query_org(db, "other.wuzzln.example.com") == "other"
+    assert query_org(db, "localhost") is None
+
+    games = random_games(30)
+    other = tuple(
+        g._replace(
+            id=f"q{g.id}",
+            timestamp=g.timestamp + 0.5,
+            org="other",
+            defense_a=g.defense_a.replace("p", "q"),
+            offense_a=g.offense_a.replace("p", "q"),
+            defense_b=g.defense_b.replace("p", "q"),
+            offense_b=g.offense_b.replace("p", "q"),
+        )
+        for g in games
+    )
+    for g in sorted(games + other, key=lambda g: g.timestamp):
+        insert(db, g)
+        insert_ratings(db, g)
+        insert_stats(db, g)
+
+    for org, org_games in ("org", games), ("other", other):
+        assert query_season_games(db, org, "season") == org_games
+        assert query_latest_rating(db, org, "season") == get_latest_rating(org_games)
+        state = StatsState()
+        for g in org_games:
+            state.update(g)
+        assert query_stats(db, org, "season") == state.latest
+    query = "SELECT org, count(DISTINCT checkpoint) FROM rating_checkpoint GROUP BY org"
+    assert db.execute(query).fetchall() == [("org", 4), ("other", 4)]
+
+
+def test_matchmakings_expire_and_are_not_duplicated(db):
+    first = Matchmaking(100, "p0", "p1", "p2", "p3", 0.4, 0.6)
+    second = Matchmaking(200, "p4", "p5", "p6", "p7", 0.5, 0.5)
+    insert_matchmakings(db, "org", [first], now=100)
+    insert_matchmakings(
+        db, "org", [second, first._replace(timestamp=200, win_probability_a=0.3)], now=200
+    )
+    assert query_matchmakings(db, "org", now=200) == [second, first._replace(win_probability_a=0.3)]
+    assert query_matchmakings(db, "org", now=200, limit=1) == [second]
+
+    # first expires, suggesting it again makes it new
+    now = 100 + MATCHMAKING_TTL
+    assert query_matchmakings(db, "org", now=now) == [second]
+    insert_matchmakings(db, "org", [first._replace(timestamp=now)], now=now)
+    assert query_matchmakings(db, "org", now=now) == [first._replace(timestamp=now), second]
+
+
+def test_connection_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr("wuzzln.database.PATH", str(tmp_path / "db.sqlite"))
+
+    async def main():
+        pool = ConnectionPool(2)
+        db1, db2 = await pool.acquire(), await pool.acquire()
+        assert db1.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        db1.execute("CREATE TABLE t(x)")
+        db1.execute("INSERT INTO t VALUES (1)")
+
+        # all connections in use
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(pool.acquire(), 0.05)
+
+        # uncommitted changes are rolled back and the connection is reused
+        pool.release(db1)
+        assert await pool.acquire() is db1
+        assert db2.execute("SELECT count(*) FROM t").fetchone() == (0,)
+        pool.release(db1)
+        pool.release(db2)
+        pool.close()
+
+        readonly_pool = ConnectionPool(1, readonly=True)
+        db = await readonly_pool.acquire()
+        assert db.execute("SELECT count(*) FROM t").fetchone() == (0,)
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("INSERT INTO t VALUES (1)")
+        readonly_pool.release(db)
+        readonly_pool.close()
+
+    asyncio.run(main())
+
+
+def test_async_connection_runs_outside_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr("wuzzln.database.PATH", str(tmp_path / "db.sqlite"))
+
+    async def main():
+        pool = ConnectionPool(2)
+        db1, db2 = AsyncConnection(await pool.acquire()), AsyncConnection(await pool.acquire())
+        await db1.run(lambda c: c.execute("CREATE TABLE t(x)"))
+        await db1.commit()
+
+        # both connections are used at the same time
+        thread_names = await asyncio.gather(
+            db1.run(lambda _: threading.current_thread().name),
+            db2.run(lambda _: threading.current_thread().name),
+        )
+        assert all(name.startswith("wuzzln-db") for name in thread_names)
+
+        await db2.run(lambda c: c.execute("INSERT INTO t VALUES (1)"))
+        await db2.commit()
+        assert await db1.fetchall("SELECT x FROM t") == [(1,)]
+        assert await db1.fetchone("SELECT count(*) FROM t") == (1,)
+
+        pool.release(db1.db)
+        pool.release(db2.db)
+        close_databases()
+        pool.close()
+
+    asyncio.run(main())
+
+
+def test_archived_games_are_read_through_views(tmp_path, monkeypatch):
+    monkeypatch.setattr("wuzzln.database.PATH", str(tmp_path / "db.sqlite"))
+    monkeypatch.setattr("wuzzln.database.ARCHIVE_PATH", str(tmp_path / "archive"))
+    db = connect(archives=False)
+    db.executescript(SCHEMA.read_text())
+    db.execute("INSERT INTO org VALUES ('org', 'org', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'org', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    seasons = ["2023-4", "2024-1", "2025-1"]
+    games = tuple(g._replace(season=seasons[i // 10]) for i, g in enumerate(random_games(30)))
+    add_games(db, games)
+    db.commit()
+    prior_game_count = game_count(db, 30)
+
+    assert archive_seasons(db, seasons[:2]) == 20
+    assert db.execute("SELECT count(*) FROM game").fetchone() == (10,)
+    player_count = sum(compute_game_count(games[20:]).values())
+    assert db.execute("SELECT count(*) FROM game_player").fetchone() == (player_count,)
+    assert sorted(p.name for p in (tmp_path / "archive").iterdir()) == [
+        "2023.sqlite",
+        "2024.sqlite",
+    ]
+    db.close()
+
+    db = connect(readonly=True)
+    assert tuple(Game(*row) for row in db.execute("SELECT * FROM game ORDER BY timestamp")) == games
+    assert game_count(db, 30) == prior_game_count
+    assert query_player_games(db, "p0", "2023-4") == [
+        g for g in games[:10] if "p0" in {g.defense_a, g.offense_a, g.defense_b, g.offense_b}
+    ]
+    db.close()
+
+    # new games still go to the game database, archives are read-only
+    db = connect()
+    insert(db, games[0]._replace(id="new", season="2025-1", timestamp=30))
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        db.execute("DELETE FROM archive_2023.game")
+    files = {name: file for _, name, file in db.execute("PRAGMA database_list")}
+    assert files["archive_2023"] == str(tmp_path / "archive" / "2023.sqlite")
+    db.close()
+
+
+def test_archive_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr("wuzzln.database.PATH", str(tmp_path / "db.sqlite"))
+    monkeypatch.setattr("wuzzln.database.ARCHIVE_PATH", str(tmp_path / "archive"))
+    db = connect(archives=False)
+    db.executescript(SCHEMA.read_text())
+    db.execute("INSERT INTO org VALUES ('org', 'org', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'org', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    seasons = ["2023-4", "2024-1", "2025-1"]
+    add_games(db, (g._replace(season=seasons[i // 10]) for i, g in enumerate(random_games(30))))
+    db.commit()
+    db.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 2)
+
+    with pytest.raises(ValueError):
+        archive_seasons(db, seasons)
+    assert db.execute("SELECT count(*) FROM game").fetchone() == (30,)
+    assert archive_seasons(db, seasons[:2]) == 20
+    with pytest.raises(ValueError):
+        archive_seasons(db, seasons[2:])
+    db.close()
+
+
+def test_upgraded_database_shows_games(tmp_path):
+    # schema before organizations, games were stored with the placeholder org "org"
+    schema = SCHEMA.read_text()
+    baseline = schema[: schema.index("-- queries are scoped to an org")]
+    db = sqlite3.connect(tmp_path / "db.sqlite")
+    db.executescript(baseline + "CREATE INDEX game_season_idx ON game(timestamp, season);")
+    db.execute("PRAGMA foreign_keys = OFF")
+    db.execute("INSERT INTO org VALUES ('acme', 'acme', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'acme', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    games = random_games(30)
+    db.executemany("INSERT INTO game VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", games)
+    db.commit()
+
+    # the upgrade steps of the README
+    readme = (Path(__file__).parent.parent / "README.md").read_text()
+    upgrade = readme[readme.index("```sql", readme.index("### Upgrade database")) + 6 :]
+    upgrade = upgrade[: upgrade.index("```")]
+    before, after = upgrade.split("-- then run everything after the game_org_idx index")
+    db.executescript(before)
+    db.executescript(schema[schema.index("-- one row per player and game") :])
+    db.executescript(after[after.index("\n") :])
+    rebuild_missing_ratings(db)
+    rebuild_missing_stats(db)
+
+    games = tuple(g._replace(org="acme") for g in games)
+    assert query_season_games(db, "acme", "season") == games
+    assert query_player_games(db, "p0", "season") == [
+        g for g in games if "p0" in {g.defense_a, g.offense_a, g.defense_b, g.offense_b}
+    ]
+    assert query_latest_rating(db, "acme", "season") == get_latest_rating(games)
+    assert query_stats(db, "acme", "season").keys() == {f"p{i}" for i in range(8)}
+    db.close()
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import time
+
+from wuzzln import executor
+from wuzzln.executor import run_cpu_bound, shutdown_executor
+
+
+def test_run_cpu_bound_off_event_loop():
+    async def main():
+        return await run_cpu_bound(threading.get_ident), threading.get_ident()
+
+    worker_thread, loop_thread = asyncio.run(main())
+    assert worker_thread != loop_thread
+    shutdown_executor()
+
+
+def test_run_cpu_bound_queues_above_max_concurrency(monkeypatch, caplog):
+    monkeypatch.setattr(executor, "MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(executor, "stats", executor.stats.__class__(executor.ExecutorStats))
+
+    def work(seconds: float) -> float:
+        time.sleep(seconds)
+        return seconds
+
+    async def main():
+        return await asyncio.gather(*(run_cpu_bound(work, 0.1) for _ in range(4)))
+
+    assert asyncio.run(main()) == [0.1] * 4
+    with caplog.at_level("INFO", logger="wuzzln.executor"):
+        shutdown_executor()
+
+    s = executor.stats["test_run_cpu_bound_queues_above_max_concurrency.<locals>.work"]
+    assert s.count == 4
+    assert s.run_time >= 0.4
+    # two computations had to wait for the first two
+    assert s.max_queue_time >= 0.09
+    assert s.mean_queue_time >= 0.04
+    assert "work ran 4 times" in caplog.text
@@ -0,0 +1,54 @@
+import random
+from typing import Iterator
+
+from wuzzln.matching import max_weight_matching
+
+
+def all_matchings(
+    vertices: list[int], edges: set[tuple[int, int]]
+) -> Iterator[list[tuple[int, int]]]:
+    if not vertices:
+        yield []
+        return
+    v, rest = vertices[0], vertices[1:]
+    # v unmatched
+    yield from all_matchings(rest, edges)
+    for i, u in enumerate(rest):
+        if (v, u) in edges:
+            for matching in all_matchings(rest[:i] + rest[i + 1 :], edges):
+                yield [(v, u), *matching]
+
+
+def test_max_weight_matching_equals_brute_force():
+    rand = random.Random(394)
+    for _ in range(300):
+        n = rand.randint(2, 8)
+        density = rand.choice([0.3, 0.6, 1])
+        edges = [
+            (i, j, rand.randint(-5, 30))
+            for i in range(n)
+            for j in range(i + 1, n)
+            if rand.random() < density
+        ]
+        if not edges:
+            continue
+        weight = {(i, j): w for i, j, w in edges}
+        n = 1 + max(j for _, j, _ in edges)
+
+        for max_cardinality in False, True:
+
+            def score(matching: list[tuple[int, int]]) -> tuple[int, int]:
+                total = sum(weight[e] for e in matching)
+                return (len(matching), total) if max_cardinality else (0, total)
+
+            mate = max_weight_matching(edges, max_cardinality)
+            matching = [(v, u) for v, u in enumerate(mate) if v < u]
+            assert all(mate[u] == v for v, u in matching)
+            best = max(all_matchings(list(range(n)), set(weight)), key=score)
+            assert score(matching) == score(best)
+
+
+def test_max_weight_matching_negative_weights():
+    assert max_weight_matching([]) == []
+    assert max_weight_matching([(0, 1, -1)]) == [-1, -1]
+    assert max_weight_matching([(0, 1, -1)], max_cardinality=True) == [1, 0]
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+import trueskill as ts
+
+from wuzzln.data import Game, Rank
+from wuzzln.rating import (
+    RatingHistory,
+    RatingState,
+    compute_ratings,
+    get_latest_rating,
+    predict_ratings,
+    rate_2v2,
+)
+
+
+def random_games(n: int, players: int = 8, seed: int = 394) -> tuple[Game, ...]:
+    rand = random.Random(seed)
+    games = []
+    for i in range(n):
+        def_a, off_a, def_b, off_b = rand.sample([f"p{p}" for p in range(players)], 4)
+        if rand.random() < 0.1:
+            # 1v1
+            off_a, off_b = def_a, def_b
+        score_a = rand.randint(0, 10)
+        score_b = 10 if score_a < 10 else rand.randint(0, 9)
+        games.append(
+            Game(f"g{i}", i, "org", "season", def_a, off_a, def_b, off_b, score_a, score_b)
+        )
+    return tuple(games)
+
+
+def test_incremental_equals_replay():
+    games = random_games(100)
+    state = RatingState()
+    hist = [r for g in games for r in state.update(g)]
+    assert hist == list(compute_ratings(games))
+
+    latest = {}
+    for r in compute_ratings(games):
+        latest[r.player] = r
+    assert state.latest == latest
+
+
+def test_continue_from_latest_rating():
+    games = random_games(50)
+    state = RatingState()
+    for g in games[:20]:
+        state.update(g)
+    continued = RatingState(state.latest)
+    hist = [r for g in games[20:] for r in continued.update(g)]
+    assert hist == list(compute_ratings(games))[-len(hist) :]
+    assert continued.latest == get_latest_rating(games)
+
+
+def test_rate_2v2_equals_factor_graph():
+    rand = random.Random(394)
+    for _ in range(200):
+        team_a = ts.Rating(rand.uniform(0, 40), rand.uniform(0.5, 9)), ts.Rating(30, 1)
+        team_b = ts.Rating(rand.uniform(0, 40), rand.uniform(0.5, 9)), ts.Rating(5, 8)
+        score_a, score_b = rand.choice([(10, 3), (0, 10)])
+        expected = ts.rate([team_a, team_b], [-score_a, -score_b])
+        actual = rate_2v2(team_a, team_b, score_a, score_b)
+        for exp_team, act_team in zip(expected, actual):
+            for exp, act in zip(exp_team, act_team):
+                assert act.mu == pytest.approx(exp.mu, abs=1e-9)
+                assert act.sigma == pytest.approx(exp.sigma, abs=1e-9)
+
+
+def test_rating_history_latest_and_previous():
+    games = random_games(80)
+    state = RatingState()
+    hist = RatingHistory()
+    for g in games:
+        hist.extend(state.update(g))
+
+    assert len(hist) == sum(
+        len({g.defense_a, g.offense_a, g.defense_b, g.offense_b}) for g in games
+    )
+    assert hist.latest() == state.latest
+    assert hist.previous() == state.previous
+    with pytest.raises(ValueError):
+        hist.append(hist[0]._replace(season="other"))
+
+
+def test_predict_ratings_both_outcomes():
+    games = random_games(30)
+    latest = get_latest_rating(games)
+    before = dict(latest)
+    matchups = [("p0", "p1", "p2", "p3"), ("p4", "p4", "new", "new")]
+    prospects = predict_ratings(latest, matchups, "season", 100)
+    assert latest == before
+
+    for (def_a, off_a, def_b, off_b), prospect in zip(matchups, prospects):
+        for score_a, score_b in (1, 0), (0, 1):
+            game = Game("", 100, "org", "season", def_a, off_a, def_b, off_b, score_a, score_b)
+            state = RatingState(latest)
+            for r in state.update(game):
+                won = (r.player in (def_a, off_a)) == (score_a > score_b)
+                assert (prospect[r.player].win if won else prospect[r.player].loss) == r
+
+    assert prospects[1]["new"].rank == Rank.IRON
+    assert prospects[1]["new"].rank_up
+    assert not prospects[1]["new"].rank_down
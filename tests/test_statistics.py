@@ -1,10 +1,14 @@
 from collections import Counter
 
+from test_rating import random_games
+
 from wuzzln.data import Game
 from wuzzln.statistics import (
+    StatsState,
     compute_1v1_count,
     compute_game_count,
     compute_streak,
+    compute_unique_people_count,
     compute_zero_score_count,
 )
 
@@ -121,3 +125,23 @@ def test_streak_reset():
     ]
     assert compute_streak(games, "win") == Counter({"a": 1, "b": 1, "c": 0, "d": 0})
     assert compute_streak(games, "loss") == Counter({"a": 0, "b": 0, "c": 1, "d": 1})
+
+
+def test_stats_state_equals_compute():
+    games = random_games(200)
+    prior = Counter({"p0": 30, "p1": 10, "p2": 24})
+    state = StatsState(prior_game_count=prior, min_game_count=25)
+    for g in games:
+        state.update(g)
+
+    def field(name):
+        return Counter({p: getattr(s, name) for p, s in state.latest.items() if getattr(s, name)})
+
+    assert all(s.prior_game_count == prior[p] for p, s in state.latest.items())
+    assert field("game_count") == compute_game_count(games)
+    assert field("one_vs_one_count") == compute_1v1_count(games)
+    assert field("people_count") == compute_unique_people_count(games)
+    assert field("zero_win_count") == compute_zero_score_count(games, prior, "win")
+    assert field("zero_loss_count") == compute_zero_score_count(games, prior, "loss")
+    assert field("win_streak") == +compute_streak(games, "win")
+    assert field("loss_streak") == +compute_streak(games, "loss")
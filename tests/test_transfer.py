@@ -0,0 +1,95 @@
+import io
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from test_rating import random_games
+
+from wuzzln.data import Game, get_season
+from wuzzln.database import query_latest_rating, query_stats
+from wuzzln.rating import get_latest_rating
+from wuzzln.transfer import export_games, import_games, read_games, write_games
+
+SCHEMA = Path(__file__).parent.parent / "database" / "create.sql"
+
+
+def dated_games(n: int) -> tuple[Game, ...]:
+    # hourly games in November 2023, files are only read if the season matches the timestamp
+    games = (g._replace(timestamp=1_700_000_000 + g.timestamp * 3600) for g in random_games(n))
+    return tuple(g._replace(season=get_season(datetime.fromtimestamp(g.timestamp))) for g in games)
+
+
+def create_database() -> sqlite3.Connection:
+    db = sqlite3.connect(":memory:")
+    db.executescript(SCHEMA.read_text())
+    db.execute("INSERT INTO org VALUES ('org', 'org', '#fff', '#000', '')")
+    db.executemany("INSERT INTO player VALUES (?, 'org', ?, 1)", [(f"p{i}", i) for i in range(8)])
+    db.commit()
+    return db
+
+
+@pytest.mark.parametrize("format", ["csv", "jsonl"])
+def test_export_import_roundtrip(format):
+    games = dated_games(50)
+    season = games[0].season
+    source = create_database()
+    assert import_games(source, iter(games), batch_size=7) == len(games)
+
+    file = io.StringIO()
+    assert write_games(file, export_games(source), format) == len(games)
+    file.seek(0)
+    target = create_database()
+    import_games(target, read_games(file, format))
+
+    assert tuple(export_games(target)) == games
+    assert query_latest_rating(target, "org", season) == get_latest_rating(games)
+    assert query_stats(target, "org", season) == query_stats(source, "org", season)
+
+
+def test_invalid_game_imports_nothing():
+    db = create_database()
+    file = io.StringIO()
+    write_games(file, dated_games(20), "jsonl")
+    file.write(file.getvalue().splitlines()[0].replace('"score_b": ', '"score_b": 1') + "\n")
+    file.seek(0)
+
+    with pytest.raises(ValueError, match="Game 21"):
+        import_games(db, read_games(file, "jsonl"), batch_size=5)
+    assert db.execute("SELECT count(*) FROM game").fetchone() == (0,)
+
+    games = [random_games(1)[0]._replace(defense_a="nobody")]
+    with pytest.raises(ValueError, match="Unknown player nobody"):
+        import_games(db, games)
+    db.execute("INSERT INTO org VALUES ('other', 'other', '#fff', '#000', '')")
+    with pytest.raises(ValueError, match="not in other"):
+        import_games(db, [random_games(1)[0]._replace(org="other")])
+    assert db.execute("SELECT count(*) FROM rating").fetchone() == (0,)
+
+
+def test_malformed_rows_are_numbered():
+    game = dated_games(1)[0]._asdict()
+    line = json.dumps(game)
+    cases = {
+        "{": "Game 2: Expecting property name",
+        "[]": "Game 2: Not a JSON object",
+        json.dumps({**game, "score_a": [1]}): "Game 2: Wrong type",
+        json.dumps({**game, "season": "2024-1"}): "Game 2: Season 2024-1",
+    }
+    for row, error in cases.items():
+        with pytest.raises(ValueError, match=error):
+            list(read_games(io.StringIO(f"{line}\n\n{row}\n"), "jsonl"))
+    assert len(list(read_games(io.StringIO(f"\n{line}\n  \n{line}\n"), "jsonl"))) == 2
+
+
+def test_same_timestamp_imports_nothing():
+    db = create_database()
+    games = random_games(20)
+    tie = games[5]._replace(id="tie", timestamp=games[10].timestamp)
+    with pytest.raises(ValueError, match="at timestamp"):
+        import_games(db, [*games, tie], batch_size=5)
+    assert db.execute("SELECT count(*) FROM game").fetchone() == (0,)
+
+    # other seasons may have games at the same time
+    assert import_games(db, [*games, tie._replace(season="other")]) == 21
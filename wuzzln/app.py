@@ -1,16 +1,24 @@
-import sqlite3
-from collections import deque
 from pathlib import Path
 
 from litestar import Litestar
 from litestar.config.compression import CompressionConfig
 from litestar.contrib.jinja import JinjaTemplateEngine
-from litestar.datastructures.state import State
 from litestar.di import Provide
 from litestar.logging.config import LoggingConfig
 from litestar.static_files.config import StaticFilesConfig
 from litestar.template import TemplateConfig
 
+from wuzzln.backup import start_backups, stop_backups
+from wuzzln.cli import CLIPlugin
+from wuzzln.database import (
+    close_databases,
+    connect,
+    get_database,
+    get_org,
+    rebuild_missing_ratings,
+    rebuild_missing_stats,
+)
+from wuzzln.executor import shutdown_executor
 from wuzzln.routes.add import add_game, delete_game, get_add_game_page
 from wuzzln.routes.history import get_history_page
 from wuzzln.routes.leaderboard import get_leaderboard_page
@@ -28,9 +36,14 @@ logging_config = LoggingConfig(
 )
 
 
-async def get_database() -> sqlite3.Connection:
-    """Get database connection."""
-    return sqlite3.connect("database/db.sqlite", detect_types=1)
+def init_database() -> None:
+    """Derive missing data e.g. ratings after a migration."""
+    db = connect()
+    try:
+        rebuild_missing_ratings(db)
+        rebuild_missing_stats(db)
+    finally:
+        db.close()
 
 
 get_now = get_datetime_func("NOW")
@@ -45,9 +58,12 @@ def register_template_callables(tmpl_engine: JinjaTemplateEngine):
 app = Litestar(
     dependencies={
         "db": Provide(get_database),
+        "org": Provide(get_org),
         "now": Provide(get_now, sync_to_thread=True),
     },
-    state=State({"matchmakings": deque(maxlen=10)}),
+    on_startup=[init_database, start_backups],
+    on_shutdown=[stop_backups, shutdown_executor, close_databases],
+    plugins=[CLIPlugin()],
     route_handlers=[
         get_leaderboard_page,
         get_add_game_page,
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, NamedTuple, Sequence
+
+import trueskill as ts
+
+from wuzzln.data import Game, SeasonId
+from wuzzln.matchmaking import win_probability
+from wuzzln.rating import RatingState
+
+
+class Parameters(NamedTuple):
+    mu: float = ts.MU
+    sigma: float = ts.SIGMA
+    beta: float = ts.BETA
+    tau: float = ts.TAU
+
+
+@dataclass
+class CalibrationBin:
+    predicted: float  # mean predicted win probability
+    observed: float  # fraction of games actually won
+    count: int
+
+
+@dataclass
+class BacktestResult:
+    parameters: Parameters
+    game_count: int
+    log_loss: float
+    calibration_error: float  # expected calibration error
+    calibration: list[CalibrationBin]
+
+
+def predict_games(games_sorted: Iterable[Game], env: ts.TrueSkill) -> list[tuple[float, bool]]:
+    """Predict the outcome of each game from the ratings right before it.
+
+    :param games_sorted: games sorted by time within their season
+    :param env: trueskill environment to rate games with
+    :return: win probability of team a and whether team a won for each game (draws are skipped)
+    """
+    states: dict[SeasonId, RatingState] = {}
+    predictions = []
+    for g in games_sorted:
+        if (state := states.get(g.season)) is None:
+            state = states[g.season] = RatingState(env=env)
+        if g.score_a != g.score_b:
+            new = env.create_rating()
+            team_a = state.defense.get(g.defense_a, new), state.offense.get(g.offense_a, new)
+            team_b = state.defense.get(g.defense_b, new), state.offense.get(g.offense_b, new)
+            predictions.append((win_probability(team_a, team_b, env), g.score_a > g.score_b))
+        state.update(g)
+    return predictions
+
+
+def score_predictions(
+    predictions: Sequence[tuple[float, bool]], bin_count: int = 10
+) -> tuple[float, float, list[CalibrationBin]]:
+    """Score win probabilities against actual outcomes.
+
+    :param predictions: win probability and whether the game was won
+    :param bin_count: number of equally wide probability bins for calibration
+    :return: log-loss, expected calibration error, calibration bins
+    """
+    if not predictions:
+        return 0, 0, []
+
+    n = len(predictions)
+    log_loss = -sum(math.log(max(p if won else 1 - p, 1e-15)) for p, won in predictions) / n
+
+    bins: list[list[tuple[float, bool]]] = [[] for _ in range(bin_count)]
+    for p, won in predictions:
+        bins[min(int(p * bin_count), bin_count - 1)].append((p, won))
+
+    calibration = [
+        CalibrationBin(sum(p for p, _ in b) / len(b), sum(won for _, won in b) / len(b), len(b))
+        for b in bins
+        if b
+    ]
+    calibration_error = sum(c.count * abs(c.predicted - c.observed) for c in calibration) / n
+
+    return log_loss, calibration_error, calibration
+
+
+# games of a worker process, sent once instead of with every grid point
+worker_games: Sequence[Game] = ()
+
+
+def set_worker_games(games_sorted: Sequence[Game]) -> None:
+    global worker_games
+    worker_games = games_sorted
+
+
+def backtest(parameters: Parameters, games_sorted: Sequence[Game] | None = None) -> BacktestResult:
+    """Replay games with different rating parameters and score the predictions.
+
+    :param parameters: trueskill parameters
+    :param games_sorted: games sorted by time within their season, defaults to worker games
+    :return: scores
+    """
+    games_sorted = worker_games if games_sorted is None else games_sorted
+    env = ts.TrueSkill(*parameters, draw_probability=ts.global_env().draw_probability)
+    predictions = predict_games(games_sorted, env)
+    log_loss, calibration_error, calibration = score_predictions(predictions)
+    return BacktestResult(parameters, len(predictions), log_loss, calibration_error, calibration)
+
+
+def sweep(
+    games_sorted: Sequence[Game], grid: Iterable[Parameters], max_workers: int | None = None
+) -> list[BacktestResult]:
+    """Backtest every parameter combination, each in its own process.
+
+    :param games_sorted: games sorted by time within their season
+    :param grid: parameters to try
+    :param max_workers: maximum number of processes, defaults to number of CPUs
+    :return: scores sorted by log-loss (best first)
+    """
+    with ProcessPoolExecutor(
+        max_workers, initializer=set_worker_games, initargs=(games_sorted,)
+    ) as pool:
+        results = list(pool.map(backtest, grid))
+    return sorted(results, key=lambda r: r.log_loss)
+
+
+def write_report(path: Path, games_sorted: Sequence[Game], results: list[BacktestResult]) -> None:
+    """Write backtest results together with a fingerprint of the games they are based on.
+
+    :param path: json file to write
+    :param games_sorted: games used for the backtest
+    :param results: backtest results
+    """
+    fingerprint = hashlib.sha256()
+    for g in games_sorted:
+        fingerprint.update(",".join(map(str, g)).encode() + b"\n")
+
+    report = {
+        "game_count": len(games_sorted),
+        "games_sha256": fingerprint.hexdigest(),
+        "draw_probability": ts.global_env().draw_probability,
+        "results": [asdict(r) | {"parameters": r.parameters._asdict()} for r in results],
+    }
+    path.write_text(json.dumps(report, indent=2))
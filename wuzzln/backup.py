@@ -0,0 +1,144 @@
+import asyncio
+import fcntl
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from wuzzln.database import connect
+
+logger = logging.getLogger(__name__)
+
+# next to the game database, since that is the only writable mount of the container
+BACKUP_PATH = "database/backup"
+
+# number of snapshots kept, older ones are deleted after each backup
+BACKUP_KEEP = 7
+
+# pages copied per step and seconds slept between steps, locks are released in between so
+# writers are only blocked for the duration of a step
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.01
+
+# hours between scheduled backups of the running service, 0 disables them
+BACKUP_INTERVAL = float(os.environ.get("BACKUP_INTERVAL", 24))
+
+
+def list_snapshots(path: str | Path = BACKUP_PATH) -> list[Path]:
+    """Find snapshots of the game database.
+
+    :param path: backup directory
+    :return: snapshots from oldest to newest
+    """
+    return sorted(Path(path).glob("db-*.sqlite.gz"))
+
+
+def backup_database(
+    path: str | Path = BACKUP_PATH,
+    keep: int = BACKUP_KEEP,
+    pages: int = BACKUP_PAGES,
+    sleep: float = BACKUP_SLEEP,
+) -> Path | None:
+    """Write a compressed snapshot of the game database while the service keeps running.
+
+    The database is copied with the online backup API a few pages at a time. If games are added
+    in between, the copy starts over, so the snapshot is always consistent. Archives are not
+    part of the snapshot, since they never change after `games archive`.
+
+    :param path: backup directory
+    :param keep: number of snapshots to keep
+    :param pages: pages copied per step
+    :param sleep: seconds between steps
+    :return: new snapshot or `None` if another process is already writing one
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / "backup.lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        start = time.perf_counter()
+        name = f"db-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.sqlite"
+        copy = path / name
+        snapshot = path / f"{name}.gz"
+        partial = path / f"{name}.gz.tmp"
+        try:
+            source = connect(readonly=True, archives=False)
+            target = sqlite3.connect(copy)
+            try:
+                source.backup(target, pages=pages, sleep=sleep)
+                # the copy inherits WAL mode, switch back so it is a single self-contained file
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+
+            with open(copy, "rb") as src, gzip.open(partial, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            partial.rename(snapshot)
+        finally:
+            copy.unlink(missing_ok=True)
+            partial.unlink(missing_ok=True)
+
+        for old in list_snapshots(path)[:-keep]:
+            old.unlink()
+        logger.info("Wrote %s in %.1fs", snapshot, time.perf_counter() - start)
+        return snapshot
+
+
+def restore_database(snapshot: str | Path, target: str | Path) -> None:
+    """Decompress a snapshot, e.g. to replace the game database while the service is stopped.
+
+    :param snapshot: compressed snapshot
+    :param target: path of the restored database, must not exist
+    :raise FileExistsError: if target exists
+    """
+    with gzip.open(snapshot, "rb") as src, open(target, "xb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+async def schedule_backups(interval: float = BACKUP_INTERVAL) -> None:
+    """Back up the game database forever, e.g. as a task of the running service.
+
+    Waits for the remaining interval since the newest snapshot, so restarting the service does
+    not cause extra backups. Failed backups are logged and retried after the interval, as are
+    backups skipped because another worker is writing one.
+
+    :param interval: hours between backups
+    """
+    while True:
+        snapshots = list_snapshots()
+        age = time.time() - snapshots[-1].stat().st_mtime if snapshots else float("inf")
+        await asyncio.sleep(max(0, interval * 3600 - age))
+        try:
+            snapshot = await asyncio.to_thread(backup_database)
+        except Exception:
+            logger.exception("Backup failed")
+            snapshot = None
+        if snapshot is None:
+            await asyncio.sleep(interval * 3600)
+
+
+# scheduled by the running service, removed on shutdown
+backup_task: asyncio.Task | None = None
+
+
+async def start_backups() -> None:
+    """Start scheduled backups on startup of the service, unless disabled."""
+    global backup_task
+    if BACKUP_INTERVAL > 0 and backup_task is None:
+        backup_task = asyncio.get_running_loop().create_task(schedule_backups())
+
+
+async def stop_backups() -> None:
+    """Cancel scheduled backups, a snapshot being written is finished in its thread."""
+    global backup_task
+    if backup_task is not None:
+        backup_task.cancel()
+        backup_task = None
@@ -0,0 +1,198 @@
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from itertools import product
+from pathlib import Path
+
+import click
+import trueskill as ts
+from litestar.plugins import CLIPluginProtocol
+
+from wuzzln.backtest import Parameters, sweep, write_report
+from wuzzln.backup import BACKUP_KEEP, BACKUP_PATH, backup_database, restore_database
+from wuzzln.data import Game, get_season
+from wuzzln.database import archive_seasons, connect, recompute_ratings, recompute_stats
+from wuzzln.transfer import Format, export_games, import_games, read_games, write_games
+
+
+class CLIPlugin(CLIPluginProtocol):
+    """Maintenance commands e.g. `litestar --app wuzzln.app:app ratings recompute`."""
+
+    def on_cli_init(self, cli: click.Group) -> None:
+        cli.add_command(ratings)
+        cli.add_command(stats)
+        cli.add_command(games)
+        cli.add_command(backup)
+
+
+@click.group()
+def ratings():
+    """Manage ratings derived from games."""
+
+
+@ratings.command()
+@click.option("--season", "seasons", multiple=True, help="Season to recompute (default: all)")
+@click.option("--org", "orgs", multiple=True, help="Org to recompute (default: all)")
+@click.option("--workers", type=int, default=None, help="Number of processes (default: #CPUs)")
+def recompute(seasons: tuple[str, ...], orgs: tuple[str, ...], workers: int | None):
+    """Recompute ratings of all games, one season of an org per process."""
+    start = time.perf_counter()
+    db = connect()
+    try:
+        recompute_ratings(db, seasons or None, max_workers=workers, orgs=orgs or None)
+    finally:
+        db.close()
+    click.echo(f"Recomputed ratings in {time.perf_counter() - start:.1f}s")
+
+
+@ratings.command()
+@click.option("--mu", multiple=True, type=float, default=[ts.MU], show_default=True)
+@click.option("--sigma", multiple=True, type=float, default=[ts.SIGMA], show_default=True)
+@click.option("--beta", multiple=True, type=float, default=[ts.BETA], show_default=True)
+@click.option("--tau", multiple=True, type=float, default=[ts.TAU], show_default=True)
+@click.option("--workers", type=int, default=None, help="Number of processes (default: #CPUs)")
+@click.option("--output", type=Path, default=Path("backtest.json"), show_default=True)
+def backtest(
+    mu: tuple[float, ...],
+    sigma: tuple[float, ...],
+    beta: tuple[float, ...],
+    tau: tuple[float, ...],
+    workers: int | None,
+    output: Path,
+):
+    """Score win predictions of all games for every combination of rating parameters."""
+    start = time.perf_counter()
+    db = connect()
+    try:
+        query = "SELECT * FROM game ORDER BY season, timestamp"
+        games = [Game(*row) for row in db.execute(query)]
+    finally:
+        db.close()
+
+    grid = [Parameters(*params) for params in product(mu, sigma, beta, tau)]
+    results = sweep(games, grid, max_workers=workers)
+    write_report(output, games, results)
+
+    for r in results[:10]:
+        params = " ".join(f"{k}={v:.3f}" for k, v in r.parameters._asdict().items())
+        click.echo(f"{params}  log-loss={r.log_loss:.4f}  ece={r.calibration_error:.4f}")
+    click.echo(f"Backtested {len(grid)} parameter sets in {time.perf_counter() - start:.1f}s")
+
+
+@click.group()
+def stats():
+    """Manage player statistics derived from games."""
+
+
+@stats.command()
+@click.option("--season", "seasons", multiple=True, help="Season to rebuild (default: all)")
+@click.option("--org", "orgs", multiple=True, help="Org to rebuild (default: all)")
+def rebuild(seasons: tuple[str, ...], orgs: tuple[str, ...]):
+    """Rebuild player statistics from all games."""
+    start = time.perf_counter()
+    db = connect()
+    try:
+        recompute_stats(db, seasons or None, orgs or None)
+    finally:
+        db.close()
+    click.echo(f"Rebuilt statistics in {time.perf_counter() - start:.1f}s")
+
+
+@click.group()
+def games():
+    """Import and export games as csv or json lines."""
+
+
+def get_format(path: Path, format: Format | None) -> Format:
+    if format is None:
+        format = "jsonl" if path.suffix in {".jsonl", ".json"} else "csv"
+    return format
+
+
+@games.command("import")
+@click.argument("path", type=Path)
+@click.option("--format", type=click.Choice(["csv", "jsonl"]), help="Default: from file suffix")
+def import_(path: Path, format: Format | None):
+    """Add games from a file (- for stdin) and rebuild ratings of their seasons."""
+    start = time.perf_counter()
+    db = connect()
+    try:
+        with sys.stdin if str(path) == "-" else path.open(newline="") as f:
+            count = import_games(db, read_games(f, get_format(path, format)))
+    except (ValueError, sqlite3.IntegrityError) as e:
+        raise click.ClickException(f"Nothing imported: {e}") from None
+    finally:
+        db.close()
+    click.echo(f"Imported {count} games in {time.perf_counter() - start:.1f}s", err=True)
+
+
+@games.command("export")
+@click.argument("path", type=Path)
+@click.option("--season", "seasons", multiple=True, help="Season to export (default: all)")
+@click.option("--format", type=click.Choice(["csv", "jsonl"]), help="Default: from file suffix")
+def export(path: Path, seasons: tuple[str, ...], format: Format | None):
+    """Write games to a file (- for stdout)."""
+    start = time.perf_counter()
+    db = connect(readonly=True)
+    try:
+        with sys.stdout if str(path) == "-" else path.open("w", newline="") as f:
+            count = write_games(f, export_games(db, seasons or None), get_format(path, format))
+    finally:
+        db.close()
+    click.echo(f"Exported {count} games in {time.perf_counter() - start:.1f}s", err=True)
+
+
+@games.command()
+@click.option("--before", help="Archive seasons before this one (default: current season)")
+def archive(before: str | None):
+    """Move games of finished seasons to one archive file per year.
+
+    Restart the service afterwards, archives are attached when connecting.
+    """
+    start = time.perf_counter()
+    before = before or get_season(datetime.now())
+    db = connect(archives=False)
+    try:
+        query = "SELECT DISTINCT season FROM game WHERE season < ?"
+        seasons = [row[0] for row in db.execute(query, (before,))]
+        count = archive_seasons(db, seasons)
+    except ValueError as e:
+        raise click.ClickException(f"Nothing archived: {e}") from None
+    finally:
+        db.close()
+    click.echo(
+        f"Archived {count} games of {len(seasons)} seasons in {time.perf_counter() - start:.1f}s"
+    )
+
+
+@click.group()
+def backup():
+    """Back up the game database while the service is running."""
+
+
+@backup.command()
+@click.option("--path", type=Path, default=Path(BACKUP_PATH), show_default=True)
+@click.option("--keep", type=int, default=BACKUP_KEEP, show_default=True)
+def create(path: Path, keep: int):
+    """Write a compressed snapshot and delete the oldest ones."""
+    start = time.perf_counter()
+    snapshot = backup_database(path, keep)
+    if snapshot is None:
+        raise click.ClickException("Another backup is running")
+    click.echo(f"Wrote {snapshot} in {time.perf_counter() - start:.1f}s")
+
+
+@backup.command()
+@click.argument("snapshot", type=Path)
+@click.argument("target", type=Path)
+def restore(snapshot: Path, target: Path):
+    """Decompress a snapshot to a new database file.
+
+    Stop the service before replacing the game database with it.
+    """
+    try:
+        restore_database(snapshot, target)
+    except FileExistsError:
+        raise click.ClickException(f"{target} already exists") from None
+    click.echo(f"Restored {snapshot} to {target}")
@@ -54,6 +54,19 @@ class Rating(NamedTuple):
     offense_sigma: float
 
 
+class PlayerStats(NamedTuple):
+    season: SeasonId
+    player: PlayerId
+    prior_game_count: int  # games played before the season
+    game_count: int = 0
+    one_vs_one_count: int = 0
+    zero_win_count: int = 0  # won with the other team scoring zero
+    zero_loss_count: int = 0  # lost scoring zero
+    win_streak: int = 0  # won games in a row, reset by a loss
+    loss_streak: int = 0
+    people_count: int = 0  # different people played with or against, including oneself
+
+
 class Matchmaking(NamedTuple):
     timestamp: Timestamp
     defense_a: PlayerId
@@ -85,3 +98,23 @@ def get_season(now: datetime, offset: int = 0) -> SeasonId:
         year = quarters // 4
         quarter = (quarters % 4) + 1
     return f"{year}-{quarter}"
+
+
+def validate_game(game: Game) -> str | None:
+    """Check a game against the rules every stored game must follow.
+
+    Players of 1v1s must be given as defense and offense of their team.
+
+    :param game: some game
+    :return: reason why the game is invalid or None if it is valid
+    """
+    g = game
+    if not (0 <= g.score_a <= 10 and 0 <= g.score_b <= 10):
+        return "Score must be between 0 and 10"
+    elif g.score_a == g.score_b:
+        return "Games cannot end in draw"
+    elif not (g.defense_a and g.offense_a and g.defense_b and g.offense_b):
+        return "Each side must have at least one player"
+    elif {g.defense_a, g.offense_a} & {g.defense_b, g.offense_b}:
+        return "Players must not play in both teams"
+    return None
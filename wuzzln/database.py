@@ -1,23 +1,337 @@
+import asyncio
 import sqlite3
-from collections import Counter
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from itertools import chain, groupby
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Concatenate, Iterable, Mapping, Sequence
 
-from cachetools import LRUCache, cached
+from cachetools import LRUCache
+from litestar import Request
+from litestar.exceptions import NotFoundException
 
-from wuzzln.data import Game, PlayerId
+from wuzzln.data import (
+    Game,
+    Matchmaking,
+    OrgId,
+    PlayerId,
+    PlayerStats,
+    Rating,
+    SeasonId,
+    Timestamp,
+)
+from wuzzln.rating import RatingHistory, RatingState
+from wuzzln.statistics import StatsState
+
+PATH = "database/db.sqlite"
+
+# games of finished seasons moved out of the game database, one file per year
+ARCHIVE_PATH = "database/archive"
+
+# games between two rating checkpoints
+CHECKPOINT_INTERVAL = 50
+
+# seconds a suggested matchup is kept
+MATCHMAKING_TTL = 3600
+
+
+# applied to every connection, see https://www.sqlite.org/pragma.html
+PRAGMAS = {
+    "journal_mode": "WAL",  # readers and the writer don't block each other
+    "synchronous": "NORMAL",  # with WAL only loses the last commits on power loss
+    "cache_size": -16_000,  # 16 MB page cache
+    "mmap_size": 256 * 2**20,
+    "busy_timeout": 5000,  # wait for other writers instead of failing immediately
+}
+
+
+# tables of an archive, same columns as in the game database but without triggers since
+# archives are never written by the service
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS game(
+    id TEXT PRIMARY KEY NOT NULL,
+    timestamp NUMERIC NOT NULL,
+    org TEXT NOT NULL,
+    season TEXT NOT NULL,
+    defense_a TEXT NOT NULL,
+    offense_a TEXT NOT NULL,
+    defense_b TEXT NOT NULL,
+    offense_b TEXT NOT NULL,
+    score_a INT,
+    score_b INT
+);
+CREATE INDEX IF NOT EXISTS game_org_idx ON game(org, season, timestamp);
+
+CREATE TABLE IF NOT EXISTS game_player(
+    org TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    player TEXT NOT NULL,
+    team TEXT NOT NULL,
+    role TEXT NOT NULL,
+    timestamp NUMERIC NOT NULL,
+    season TEXT NOT NULL,
+    PRIMARY KEY(game_id, player)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS game_player_player_idx ON game_player(player, season, timestamp);
+CREATE INDEX IF NOT EXISTS game_player_org_idx ON game_player(org, season, timestamp);
+"""
+
+
+def connect(
+    readonly: bool = False, check_same_thread: bool = True, archives: bool = True
+) -> sqlite3.Connection:
+    """Open connection to the game database.
+
+    :param readonly: reject writes on this connection
+    :param check_same_thread: only allow using the connection from the thread that opened it
+    :param archives: read archived games too (see :func:`attach_archives`)
+    :return: connection
+    """
+    # as URI, so archives can be attached read-only even if SQLite is built without URI filenames
+    uri = Path(PATH).absolute().as_uri()
+    db = sqlite3.connect(uri, detect_types=1, check_same_thread=check_same_thread, uri=True)
+    for pragma, value in PRAGMAS.items():
+        db.execute(f"PRAGMA {pragma} = {value}")
+    if archives:
+        attach_archives(db)
+    if readonly:
+        db.execute("PRAGMA query_only = ON")
+    return db
+
+
+def attach_archives(db: sqlite3.Connection) -> list[str]:
+    """Attach all archives read-only and read games through views over all databases.
+
+    The views are temporary and named like the tables, so they take precedence in all queries
+    of this connection. Writes must name the tables of the game database e.g. `main.game`.
+    Archives created later are only seen by new connections.
+
+    :param db: connection to the game database
+    :return: names of the attached archives
+    """
+    schemas = []
+    for path in sorted(Path(ARCHIVE_PATH).glob("*.sqlite")):
+        schema = f"archive_{path.stem}"
+        if not schema.isidentifier():
+            continue
+        db.execute(f"ATTACH DATABASE ? AS {schema}", (f"{path.absolute().as_uri()}?mode=ro",))
+        db.execute(f"PRAGMA {schema}.mmap_size = {PRAGMAS['mmap_size']}")
+        schemas.append(schema)
+
+    if schemas:
+        for table in "game", "game_player":
+            # schema names are identifiers derived from archive file names
+            selects = (f"SELECT * FROM {s}.{table}" for s in ["main", *schemas])  # noqa: S608
+            db.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+    return schemas
+
+
+def archive_seasons(db: sqlite3.Connection, seasons: Iterable[SeasonId]) -> int:
+    """Move games of finished seasons from the game database to the archive of their year.
+
+    Games are copied and committed before they are deleted, so an interrupted run at worst
+    leaves games in both databases until the next run. Running services only attach new
+    archives after a restart.
+
+    :param db: connection to the game database opened without archives
+    :param seasons: seasons that don't get new games anymore
+    :raise ValueError: if connections could not attach all archives afterwards
+    :return: number of moved games
+    """
+    seasons = sorted(seasons)
+    years = {s.split("-")[0] for s in seasons}
+    archives = {p.stem for p in Path(ARCHIVE_PATH).glob("*.sqlite")} | years
+    # checked before moving any games, connecting would fail for every request otherwise
+    if len(archives) > (limit := db.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)):
+        raise ValueError(f"At most {limit} archives can be attached, {len(archives)} needed")
+
+    count = 0
+    Path(ARCHIVE_PATH).mkdir(parents=True, exist_ok=True)
+    for year, year_seasons in groupby(seasons, key=lambda s: s.split("-")[0]):
+        path = Path(ARCHIVE_PATH) / f"{year}.sqlite"
+        archive = sqlite3.connect(path)
+        try:
+            archive.executescript(ARCHIVE_SCHEMA)
+        finally:
+            archive.close()
+
+        db.execute("ATTACH DATABASE ? AS archive", (str(path),))
+        try:
+            for season in year_seasons:
+                for table in "game", "game_player":
+                    query = f"INSERT OR IGNORE INTO archive.{table} SELECT * FROM main.{table}"  # noqa: S608 table names
+                    db.execute(query + " WHERE season = ?", (season,))
+                db.commit()
+                # also deletes game_player rows and invalidates cached games
+                count += db.execute("DELETE FROM main.game WHERE season = ?", (season,)).rowcount
+                db.commit()
+        finally:
+            db.execute("DETACH DATABASE archive")
+    return count
+
+
+class ConnectionPool:
+    """Open connections reused across requests, at most `size` in use at once."""
+
+    def __init__(self, size: int, readonly: bool = False):
+        """Create empty pool, connections are opened on demand.
+
+        :param size: maximum number of connections
+        :param readonly: reject writes on pooled connections
+        """
+        self.size = size
+        self.readonly = readonly
+        self.idle: list[sqlite3.Connection] = []
+        # created on first use, so it belongs to the running event loop
+        self.available: asyncio.Semaphore | None = None
+
+    async def acquire(self) -> sqlite3.Connection:
+        """Get an idle connection or open a new one, waits if all are in use."""
+        if self.available is None:
+            self.available = asyncio.Semaphore(self.size)
+        await self.available.acquire()
+        if self.idle:
+            return self.idle.pop()
+        try:
+            # pooled connections are handed between threads, but only used by one at a time
+            return connect(self.readonly, check_same_thread=False)
+        except BaseException:
+            self.available.release()
+            raise
+
+    def release(self, db: sqlite3.Connection) -> None:
+        """Return connection to the pool, uncommitted changes are rolled back."""
+        if db.in_transaction:
+            db.rollback()
+        self.idle.append(db)
+        if self.available is not None:
+            self.available.release()
+
+    def close(self) -> None:
+        """Close idle connections."""
+        for db in self.idle:
+            db.close()
+        self.idle.clear()
+        self.available = None
+
+
+# writes are serialized by sqlite anyway, so few write connections are enough
+read_pool = ConnectionPool(8, readonly=True)
+write_pool = ConnectionPool(2)
+
+# one thread per pooled connection, so queries of all connections can run at once
+db_executor: ThreadPoolExecutor | None = None
+
+
+class AsyncConnection:
+    """Pooled connection whose blocking calls run in a thread instead of the event loop."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    async def run[**P, R](
+        self,
+        func: Callable[Concatenate[sqlite3.Connection, P], R],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> R:
+        """Call a query function with this connection e.g. `await db.run(exists, "player", ...)`.
+
+        :param func: function taking the connection as first argument
+        :return: result of the function
+        """
+        global db_executor
+        if db_executor is None:
+            db_executor = ThreadPoolExecutor(
+                read_pool.size + write_pool.size, thread_name_prefix="wuzzln-db"
+            )
+        call = partial(func, self.db, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = ()) -> list[Any]:
+        return await self.run(lambda db: db.execute(query, params).fetchall())
+
+    async def fetchone(self, query: str, params: Sequence[Any] = ()) -> Any:
+        return await self.run(lambda db: db.execute(query, params).fetchone())
+
+    async def commit(self) -> None:
+        await self.run(sqlite3.Connection.commit)
+
+
+async def get_database() -> AsyncGenerator[AsyncConnection, None]:
+    """Get read-only database connection for the duration of a request."""
+    db = await read_pool.acquire()
+    try:
+        yield AsyncConnection(db)
+    finally:
+        read_pool.release(db)
+
+
+@asynccontextmanager
+async def open_write_database() -> AsyncGenerator[AsyncConnection, None]:
+    """Get database connection that may write until the `async with` block ends.
+
+    For handlers that read and compute for a while before writing, so that they do not hold one of
+    the few write connections for the whole request.
+    """
+    db = await write_pool.acquire()
+    try:
+        yield AsyncConnection(db)
+    finally:
+        write_pool.release(db)
+
+
+async def get_write_database() -> AsyncGenerator[AsyncConnection, None]:
+    """Get database connection that may write for the duration of a request."""
+    async with open_write_database() as db:
+        yield db
+
+
+async def get_org(request: Request, db: AsyncConnection) -> OrgId:
+    """Get the org of a request from its host (see :func:`query_org`)."""
+    if (org := await db.run(query_org, request.url.hostname or "")) is None:
+        raise NotFoundException("Unknown organization")
+    return org
+
+
+def close_databases() -> None:
+    """Stop database threads and close all pooled connections."""
+    global db_executor
+    if db_executor is not None:
+        db_executor.shutdown()
+        db_executor = None
+    read_pool.close()
+    write_pool.close()
 
 
 def insert(db: sqlite3.Connection, value: Game):
-    if isinstance(value, Game):
-        fields = Game._fields
-    else:
-        raise NotImplementedError(f"Unsupported insert type: {type(value)}")
+    insert_many(db, [value])
+
+
+def insert_many(db: sqlite3.Connection, values: Iterable[Game]):
+    """Insert games in one batch.
 
+    Ratings are stored with the org of their games by :func:`store_ratings`.
+
+    :param db: game database
+    :param values: games
+    """
+    values = iter(values)
+    if (first := next(values, None)) is None:
+        return
+    elif not isinstance(first, Game):
+        raise NotImplementedError(f"Unsupported insert type: {type(first)}")
+
+    fields = first._fields
     qmarks = ",".join("?" for _ in fields)
     fields_str = ",".join(fields)
-    table = type(value).__name__
-    query = f"INSERT INTO {table}({fields_str}) VALUES ({qmarks})"
+    table = type(first).__name__
+    query = f"INSERT INTO main.{table}({fields_str}) VALUES ({qmarks})"
 
-    db.execute(query, value)
+    db.executemany(query, chain([first], values))
 
 
 def exists(db: sqlite3.Connection, table: str, column: str, value) -> bool:
@@ -26,22 +340,610 @@ def exists(db: sqlite3.Connection, table: str, column: str, value) -> bool:
     return row[0] == 1
 
 
-# TODO: it's weird that game count stat is here
-@cached(LRUCache(5), key=lambda _, timestamp: timestamp)
-def query_game_count(db: sqlite3.Connection, timestamp: float) -> Counter[PlayerId]:
-    """Get all games played before a timestamp.
+def query_org(db: sqlite3.Connection, host: str) -> OrgId | None:
+    """Find the org served at a host, e.g. `acme` at `acme.wuzzln.example.com`.
+
+    A database with a single org serves it at any host, so deployments with one org don't need
+    a subdomain.
+
+    :param db: game database
+    :param host: host name of the request
+    :return: org id or `None` if no org matches
+    """
+    subdomain = host.split(".")[0]
+    if exists(db, "org", "id", subdomain):
+        return subdomain
+    orgs = db.execute("SELECT id FROM org LIMIT 2").fetchall()
+    return orgs[0][0] if len(orgs) == 1 else None
+
+
+def query_player_names(
+    db: sqlite3.Connection, org: OrgId, active: bool = False
+) -> dict[PlayerId, str]:
+    """Get names of the players of an org.
+
+    :param db: game database
+    :param org: some org
+    :param active: only get active players
+    :return: player id to name mapping
+    """
+    query = "SELECT id, name FROM player WHERE org = ?"
+    if active:
+        query += " AND active = true"
+    return dict(db.execute(query, (org,)))
+
+
+def query_player_games(db: sqlite3.Connection, player: PlayerId, season: SeasonId) -> list[Game]:
+    """Get games of a player in a season.
 
-    Cached because this is used on the front page
+    :param db: game database
+    :param player: some player
+    :param season: some season
+    :return: games sorted by timestamp
+    """
+    query = """
+        SELECT g.* FROM game_player AS gp JOIN game AS g ON g.id = gp.game_id
+        WHERE gp.player = ? AND gp.season = ?
+        ORDER BY gp.timestamp
+    """
+    return [Game(*row) for row in db.execute(query, (player, season))]
+
+
+# games of recently viewed seasons with the game version they were read at, shared by all
+# connections since the version is stored in the database. Every org has its own cache, so
+# browsing the seasons of one org doesn't evict the games of the others.
+season_games_cache: defaultdict[OrgId, LRUCache[SeasonId, tuple[int, tuple[Game, ...]]]] = (
+    defaultdict(lambda: LRUCache(4))
+)
+season_games_lock = threading.Lock()
+
+
+def query_game_version(db: sqlite3.Connection, org: OrgId, season: SeasonId) -> int:
+    """Get a counter that changes whenever a game of a season is added, changed or deleted.
 
     :param db: game database
-    :param timestamp: unix epoch timestamp
+    :param org: org of the games
+    :param season: some season
+    :return: version of the season's games, 0 if it never had any
+    """
+    query = "SELECT version FROM game_version WHERE org = ? AND season = ?"
+    row = db.execute(query, (org, season)).fetchone()
+    return row[0] if row else 0
+
+
+def query_season_games(db: sqlite3.Connection, org: OrgId, season: SeasonId) -> tuple[Game, ...]:
+    """Get all games of a season, read from the database only if they changed since last time.
+
+    The version is read before the games, so a concurrent change at worst causes another read.
+
+    :param db: game database
+    :param org: org of the games
+    :param season: some season
+    :return: games sorted by timestamp
+    """
+    version = query_game_version(db, org, season)
+    with season_games_lock:
+        cached = season_games_cache[org].get(season)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    query = "SELECT * FROM game WHERE org = ? AND season = ? ORDER BY timestamp"
+    games = tuple(Game(*row) for row in db.execute(query, (org, season)))
+    with season_games_lock:
+        season_games_cache[org][season] = (version, games)
+    return games
+
+
+def query_rating_version(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId
+) -> tuple[int, Timestamp]:
+    """Get a value that changes whenever ratings of a season change.
+
+    Adding a game adds ratings with a new latest timestamp and deleting one removes ratings.
+
+    :param db: game database
+    :param org: org of the ratings
+    :param season: some season
+    :return: number of ratings and latest rating timestamp
+    """
+    query = """
+        SELECT count(*), coalesce(max(timestamp), 0) FROM rating
+        WHERE org = ? AND season = ?
+    """
+    count, latest = db.execute(query, (org, season)).fetchone()
+    return count, latest
+
+
+def query_partner_count(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId, players: Sequence[PlayerId]
+) -> Counter[tuple[PlayerId, PlayerId]]:
+    """Count how often two players played together in a season.
+
+    :param db: game database
+    :param org: org of the players
+    :param season: season to count games in
+    :param players: only count pairs of these players
+    :return: (defense, offense) pair mapping to number of games
+    """
+    qmarks = ",".join("?" for _ in players)
+    query = f"""
+        SELECT defense, offense, count(*) FROM (
+            SELECT defense_a AS defense, offense_a AS offense FROM game
+            WHERE org = ? AND season = ?
+            UNION ALL
+            SELECT defense_b, offense_b FROM game WHERE org = ? AND season = ?
+        )
+        WHERE defense IN ({qmarks}) AND offense IN ({qmarks})
+        GROUP BY defense, offense
+    """  # noqa: S608 only placeholders are interpolated
+    rows = db.execute(query, (org, season, org, season, *players, *players))
+    return Counter({(d, o): count for d, o, count in rows})
+
+
+def query_checkpoint(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId, before: Timestamp
+) -> Timestamp:
+    """Get timestamp of the last rating checkpoint.
+
+    :param db: game database
+    :param org: org of the ratings
+    :param season: some season
+    :param before: only consider checkpoints before this timestamp
+    :return: checkpoint timestamp or -inf if there is none
+    """
+    query = """
+        SELECT max(checkpoint) FROM rating_checkpoint
+        WHERE org = ? AND season = ? AND checkpoint < ?
+    """
+    checkpoint = db.execute(query, (org, season, before)).fetchone()[0]
+    return float("-inf") if checkpoint is None else checkpoint
+
+
+def query_latest_rating(
+    db: sqlite3.Connection,
+    org: OrgId,
+    season: SeasonId,
+    players: Iterable[PlayerId] | None = None,
+    before: Timestamp | None = None,
+) -> dict[PlayerId, Rating]:
+    """Get latest rating of players in a season.
+
+    Starts from the last checkpoint before `before` and only reads ratings after it.
+
+    :param db: game database
+    :param org: org of the players
+    :param season: season to get ratings from
+    :param players: only get ratings of these players, defaults to all
+    :param before: only consider ratings before this timestamp, defaults to all
+    :return: player to rating mapping
+    """
+    before = float("inf") if before is None else before
+    checkpoint = query_checkpoint(db, org, season, before)
+
+    player_filter = ""
+    player_params = []
+    if players is not None:
+        player_params = list(players)
+        player_filter = f"AND player IN ({','.join('?' for _ in player_params)})"
+
+    fields = ",".join(Rating._fields)
+    checkpoint_query = f"""
+        SELECT {fields} FROM rating_checkpoint
+        WHERE org = ? AND season = ? AND checkpoint = ? {player_filter}
+    """  # noqa: S608 fields of Rating and placeholders
+    rest_query = f"""
+        SELECT {fields} FROM rating
+        WHERE org = ? AND season = ? AND timestamp > ? AND timestamp < ? {player_filter}
+        ORDER BY timestamp
+    """  # noqa: S608 fields of Rating and placeholders
+    rows = chain(
+        db.execute(checkpoint_query, (org, season, checkpoint, *player_params)),
+        db.execute(rest_query, (org, season, checkpoint, before, *player_params)),
+    )
+    return {row[1]: Rating(*row) for row in rows}
+
+
+def query_previous_rating(
+    db: sqlite3.Connection, org: OrgId, latest: Mapping[PlayerId, Rating]
+) -> dict[PlayerId, Rating]:
+    """Get the rating each player had before their latest game.
+
+    :param db: game database
+    :param org: org of the players
+    :param latest: latest rating of each player
+    :return: player to rating mapping (players with a single game are missing)
+    """
+    query = f"""
+        SELECT {",".join(Rating._fields)} FROM rating
+        WHERE org = ? AND season = ? AND player = ? AND timestamp < ?
+        ORDER BY timestamp DESC
+        LIMIT 1
+    """  # noqa: S608 fields of Rating
+    previous = {}
+    for p, r in latest.items():
+        if row := db.execute(query, (org, r.season, p, r.timestamp)).fetchone():
+            previous[p] = Rating(*row)
+    return previous
+
+
+def rate_games(
+    state: RatingState, games_sorted: Iterable[Game], since_checkpoint: int = 0
+) -> tuple[RatingHistory, list[tuple]]:
+    """Rate games and take checkpoints.
+
+    :param state: ratings before the games
+    :param games_sorted: games of a season played after all games seen by `state`
+    :param since_checkpoint: number of games played since the last checkpoint
+    :return: new ratings, rows of new checkpoints
+    """
+    ratings = RatingHistory()
+    checkpoints = []
+    for g in games_sorted:
+        ratings.extend(state.update(g))
+        since_checkpoint += 1
+        if since_checkpoint >= CHECKPOINT_INTERVAL:
+            checkpoints.extend((g.timestamp, *r) for r in state.latest.values())
+            since_checkpoint = 0
+    return ratings, checkpoints
+
+
+def store_ratings(
+    db: sqlite3.Connection, org: OrgId, ratings: Iterable[Rating], checkpoints: list[tuple]
+):
+    """Insert ratings and checkpoints.
+
+    :param db: game database
+    :param org: org of the rated games
+    :param ratings: new ratings
+    :param checkpoints: rows of new checkpoints
+    """
+    fields = ",".join(("org", *Rating._fields))
+    qmarks = ",".join("?" for _ in range(len(Rating._fields) + 1))
+    query = f"INSERT INTO rating({fields}) VALUES ({qmarks})"  # noqa: S608 fields of Rating
+    db.executemany(query, ((org, *r) for r in ratings))
+    fields = ",".join(("org", "checkpoint", *Rating._fields))
+    qmarks = ",".join("?" for _ in range(len(Rating._fields) + 2))
+    query = f"INSERT INTO rating_checkpoint({fields}) VALUES ({qmarks})"  # noqa: S608 fields of Rating
+    db.executemany(query, ((org, *c) for c in checkpoints))
+
+
+def count_since_checkpoint(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId, before: Timestamp
+) -> int:
+    """Count games of a season played after the last checkpoint.
+
+    :param db: game database
+    :param org: org of the games
+    :param season: some season
+    :param before: only consider checkpoints and games before this timestamp
+    :return: number of games
+    """
+    checkpoint = query_checkpoint(db, org, season, before)
+    query = """
+        SELECT count(*) FROM game
+        WHERE org = ? AND season = ? AND timestamp > ? AND timestamp < ?
+    """
+    return db.execute(query, (org, season, checkpoint, before)).fetchone()[0]
+
+
+def insert_ratings(db: sqlite3.Connection, game: Game) -> list[Rating]:
+    """Rate a game which was played after all other games of its season.
+
+    Only the latest ratings of the players in the game are read, unless a checkpoint is due.
+    Use :func:`rebuild_ratings` instead if later games of the season exist.
+
+    :param db: game database
+    :param game: newly inserted game
+    :return: new ratings of the players in the game
+    """
+    org, season = game.org, game.season
+    since_checkpoint = count_since_checkpoint(db, org, season, game.timestamp)
+    if since_checkpoint + 1 >= CHECKPOINT_INTERVAL:
+        state = RatingState(query_latest_rating(db, org, season, before=game.timestamp))
+    else:
+        players = {game.defense_a, game.offense_a, game.defense_b, game.offense_b}
+        state = RatingState(query_latest_rating(db, org, season, players, before=game.timestamp))
+
+    ratings, checkpoints = rate_games(state, [game], since_checkpoint)
+    store_ratings(db, org, ratings, checkpoints)
+    return list(ratings)
+
+
+def rebuild_ratings(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId, since: Timestamp = 0
+) -> None:
+    """Recompute ratings of a season starting at a timestamp.
+
+    Ratings before `since` are kept and used as starting point, so after removing a recent game
+    only the games after it are replayed.
+
+    :param db: game database
+    :param org: org of the games
+    :param season: season to recompute
+    :param since: first timestamp to recompute
+    """
+    state = RatingState(query_latest_rating(db, org, season, before=since))
+    since_checkpoint = count_since_checkpoint(db, org, season, since)
+    params = (org, season, since)
+    db.execute("DELETE FROM rating WHERE org = ? AND season = ? AND timestamp >= ?", params)
+    db.execute(
+        "DELETE FROM rating_checkpoint WHERE org = ? AND season = ? AND checkpoint >= ?", params
+    )
+    query = """
+        SELECT * FROM game
+        WHERE org = ? AND season = ? AND timestamp >= ?
+        ORDER BY timestamp
+    """
+    games = [Game(*row) for row in db.execute(query, params)]
+    store_ratings(db, org, *rate_games(state, games, since_checkpoint))
+
+
+def rate_season(games_sorted: Sequence[Game]) -> tuple[RatingHistory, list[tuple]]:
+    """Rate all games of a season from scratch.
+
+    :param games_sorted: games of a season sorted by timestamp
+    :return: ratings, rows of checkpoints
+    """
+    return rate_games(RatingState(), games_sorted)
+
+
+def query_partitions(
+    db: sqlite3.Connection,
+    seasons: Iterable[SeasonId] | None = None,
+    orgs: Iterable[OrgId] | None = None,
+) -> list[tuple[OrgId, SeasonId]]:
+    """Get the seasons of each org with games, ratings and statistics are derived per season.
+
+    :param db: game database
+    :param seasons: only get these seasons, defaults to all
+    :param orgs: only get seasons of these orgs, defaults to all
+    :return: sorted (org, season) pairs
+    """
+    seasons = None if seasons is None else set(seasons)
+    orgs = None if orgs is None else set(orgs)
+    return sorted(
+        (org, season)
+        for org, season in db.execute("SELECT DISTINCT org, season FROM game")
+        if (seasons is None or season in seasons) and (orgs is None or org in orgs)
+    )
+
+
+def recompute_ratings(
+    db: sqlite3.Connection,
+    seasons: Iterable[SeasonId] | None = None,
+    max_workers: int | None = None,
+    orgs: Iterable[OrgId] | None = None,
+) -> None:
+    """Recompute ratings of whole seasons, each season of each org in its own process.
+
+    Seasons don't depend on each other, so they can be rated in parallel. Only the games are
+    sent to the workers, all writes happen in this process in a single transaction.
+
+    :param db: game database
+    :param seasons: seasons to recompute, defaults to all seasons with games
+    :param max_workers: maximum number of processes, defaults to number of CPUs
+    :param orgs: orgs to recompute, defaults to all orgs
+    """
+    partitions = query_partitions(db, seasons, orgs)
+
+    query = "SELECT * FROM game WHERE org = ? AND season = ? ORDER BY timestamp"
+    games = [[Game(*row) for row in db.execute(query, p)] for p in partitions]
+
+    if max_workers == 1 or len(partitions) < 2:
+        results = map(rate_season, games)
+    else:
+        # results are collected before the pool shuts down
+        with ProcessPoolExecutor(max_workers) as pool:
+            results = list(pool.map(rate_season, games))
+
+    for (org, season), (ratings, checkpoints) in zip(partitions, results):
+        db.execute("DELETE FROM rating WHERE org = ? AND season = ?", (org, season))
+        db.execute("DELETE FROM rating_checkpoint WHERE org = ? AND season = ?", (org, season))
+        store_ratings(db, org, ratings, checkpoints)
+    db.commit()
+
+
+def rebuild_missing_ratings(db: sqlite3.Connection) -> None:
+    """Compute ratings of all seasons that have games but no ratings (e.g. after migration).
+
+    :param db: game database
+    """
+    query = """
+        SELECT DISTINCT org, season FROM game
+        EXCEPT SELECT DISTINCT org, season FROM rating
+    """
+    for org, partitions in groupby(sorted(db.execute(query)), key=lambda p: p[0]):
+        recompute_ratings(db, [season for _, season in partitions], max_workers=1, orgs=[org])
+
+
+def query_stats(
+    db: sqlite3.Connection,
+    org: OrgId,
+    season: SeasonId,
+    players: Iterable[PlayerId] | None = None,
+) -> dict[PlayerId, PlayerStats]:
+    """Get statistics of players in a season.
+
+    :param db: game database
+    :param org: org of the players
+    :param season: some season
+    :param players: only get statistics of these players, defaults to all players of the org
+    :return: player to statistics mapping
+    """
+    fields = ",".join(PlayerStats._fields)
+    query = f"SELECT {fields} FROM player_stats WHERE org = ? AND season = ?"  # noqa: S608 fields of PlayerStats
+    params: list = [org, season]
+    if players is not None:
+        players = list(players)
+        query += f" AND player IN ({','.join('?' for _ in players)})"
+        params += players
+    return {row[1]: PlayerStats(*row) for row in db.execute(query, params)}
+
+
+def store_stats(db: sqlite3.Connection, org: OrgId, stats: Iterable[PlayerStats]) -> None:
+    """Insert or replace statistics.
+
+    :param db: game database
+    :param org: org of the players
+    :param stats: new statistics
+    """
+    fields = ",".join(("org", *PlayerStats._fields))
+    qmarks = ",".join("?" for _ in range(len(PlayerStats._fields) + 1))
+    query = f"INSERT OR REPLACE INTO player_stats({fields}) VALUES ({qmarks})"  # noqa: S608 fields of PlayerStats
+    db.executemany(query, ((org, *s) for s in stats))
+
+
+def insert_stats(db: sqlite3.Connection, game: Game) -> list[PlayerStats]:
+    """Update statistics with a game which was played after all other games of its season.
+
+    Only the statistics and past teammates/opponents of the players in the game are read.
+    Use :func:`rebuild_stats` instead if later games of the season exist.
+
+    :param db: game database
+    :param game: newly inserted game
+    :return: new statistics of the players in the game
+    """
+    players = list({game.defense_a, game.offense_a, game.defense_b, game.offense_b})
+    qmarks = ",".join("?" for _ in players)
+    query = f"""
+        SELECT DISTINCT a.player, b.player
+        FROM game_player AS a JOIN game_player AS b ON a.game_id = b.game_id
+        WHERE a.season = ? AND a.player IN ({qmarks}) AND a.timestamp < ?
+    """  # noqa: S608 only placeholders are interpolated
+    people = defaultdict(set)
+    for player, other in db.execute(query, (game.season, *players, game.timestamp)):
+        people[player].add(other)
+
+    # players new to the season played all their previous games in earlier seasons
+    query = f"""
+        SELECT player, count(*) FROM game_player
+        WHERE player IN ({qmarks}) AND timestamp < ?
+        GROUP BY player
+    """  # noqa: S608 only placeholders are interpolated
+    prior_game_count = dict(db.execute(query, (*players, game.timestamp)))
+
+    state = StatsState(query_stats(db, game.org, game.season, players), people, prior_game_count)
+    stats = state.update(game)
+    store_stats(db, game.org, stats)
+    return stats
+
+
+def rebuild_stats(db: sqlite3.Connection, org: OrgId, season: SeasonId) -> None:
+    """Recompute statistics of a season from its games e.g. after a game was deleted.
+
+    Streaks depend on the order of all games, so the whole season is replayed.
+
+    :param db: game database
+    :param org: org of the games
+    :param season: season to recompute
+    """
+    query = "SELECT * FROM game WHERE org = ? AND season = ? ORDER BY timestamp"
+    games = [Game(*row) for row in db.execute(query, (org, season))]
+    db.execute("DELETE FROM player_stats WHERE org = ? AND season = ?", (org, season))
+    if not games:
+        return
+
+    query = """
+        SELECT player, count(*) FROM game_player
+        WHERE org = ? AND timestamp < ?
+        GROUP BY player
+    """
+    state = StatsState(prior_game_count=dict(db.execute(query, (org, games[0].timestamp))))
+    for g in games:
+        state.update(g)
+    store_stats(db, org, state.latest.values())
+
+
+def recompute_stats(
+    db: sqlite3.Connection,
+    seasons: Iterable[SeasonId] | None = None,
+    orgs: Iterable[OrgId] | None = None,
+) -> None:
+    """Recompute statistics of whole seasons in a single transaction.
+
+    :param db: game database
+    :param seasons: seasons to recompute, defaults to all seasons with games
+    :param orgs: orgs to recompute, defaults to all orgs
+    """
+    for org, season in query_partitions(db, seasons, orgs):
+        rebuild_stats(db, org, season)
+    db.commit()
+
+
+def rebuild_missing_stats(db: sqlite3.Connection) -> None:
+    """Compute statistics of all seasons that have games but no statistics (e.g. after migration).
+
+    :param db: game database
+    """
+    query = """
+        SELECT DISTINCT org, season FROM game
+        EXCEPT SELECT DISTINCT org, season FROM player_stats
+    """
+    for org, season in db.execute(query).fetchall():
+        rebuild_stats(db, org, season)
+    db.commit()
+
+
+def query_recent_game_count(
+    db: sqlite3.Connection, org: OrgId, season: SeasonId, since: Timestamp
+) -> Counter[PlayerId]:
+    """Count games of each player in a season played after a timestamp.
+
+    :param db: game database
+    :param org: org of the players
+    :param season: some season
+    :param since: unix epoch timestamp
     :return: player id to game count
     """
     query = """
-        SELECT p.id, count(*)
-        FROM player AS p JOIN game AS g
-            ON p.id IN (g.defense_a, g.offense_a, g.defense_b, g.offense_b)
-        WHERE timestamp < ?
-        GROUP BY p.id
+        SELECT player, count(*) FROM game_player
+        WHERE org = ? AND season = ? AND timestamp > ?
+        GROUP BY player
+    """
+    return Counter(dict(db.execute(query, (org, season, since))))
+
+
+def insert_matchmakings(
+    db: sqlite3.Connection, org: OrgId, matchmakings: Iterable[Matchmaking], now: Timestamp
+) -> None:
+    """Store suggested matchups and delete expired ones.
+
+    A matchup that is already stored keeps its timestamp, so suggesting it again does not push
+    other matchups out of the list.
+
+    :param db: game database
+    :param org: org of the players
+    :param matchmakings: suggested matchups
+    :param now: current unix epoch timestamp
+    """
+    query = "DELETE FROM matchmaking WHERE org = ? AND timestamp <= ?"
+    db.execute(query, (org, now - MATCHMAKING_TTL))
+    fields = ",".join(("org", *Matchmaking._fields))
+    query = f"""
+        INSERT INTO matchmaking({fields}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(defense_a, offense_a, defense_b, offense_b) DO UPDATE SET
+            win_probability_a = excluded.win_probability_a,
+            win_probability_b = excluded.win_probability_b
+    """  # noqa: S608 fields of Matchmaking
+    db.executemany(query, ((org, *m) for m in matchmakings))
+
+
+def query_matchmakings(
+    db: sqlite3.Connection, org: OrgId, now: Timestamp, limit: int = 10
+) -> list[Matchmaking]:
+    """Get latest suggested matchups which are not expired yet.
+
+    :param db: game database
+    :param org: org of the players
+    :param now: current unix epoch timestamp
+    :param limit: maximum number of matchups
+    :return: matchups, newest first
     """
-    return Counter(dict(db.execute(query, (timestamp,))))
+    query = f"""
+        SELECT {",".join(Matchmaking._fields)} FROM matchmaking
+        WHERE org = ? AND timestamp > ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+    """  # noqa: S608 fields of Matchmaking
+    rows = db.execute(query, (org, now - MATCHMAKING_TTL, limit))
+    return [Matchmaking(*row) for row in rows]
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# CPU-heavy computations running at the same time, further ones wait in the queue
+MAX_CONCURRENCY = 2
+
+# log computations that waited longer than this many seconds for their turn
+SLOW_QUEUE_TIME = 0.5
+
+
+@dataclass
+class ExecutorStats:
+    count: int = 0
+    queue_time: float = 0  # total seconds waited before running
+    max_queue_time: float = 0
+    run_time: float = 0  # total seconds running
+
+    @property
+    def mean_queue_time(self) -> float:
+        return self.queue_time / self.count if self.count else 0
+
+
+# created on first use and removed on shutdown, so the app can be started again e.g. in tests
+executor: ThreadPoolExecutor | None = None
+
+# worker processes shared by computations that use more than one CPU, started from a fork server
+# since forking the multithreaded server may deadlock, created on first use and removed on shutdown
+process_pool: ProcessPoolExecutor | None = None
+process_pool_lock = threading.Lock()
+
+# stats per computation since start, only updated from the event loop, logged on shutdown
+stats: defaultdict[str, ExecutorStats] = defaultdict(ExecutorStats)
+
+
+async def run_cpu_bound[**P, R](func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+    """Run a computation outside the event loop, so other requests are not blocked by it.
+
+    At most `MAX_CONCURRENCY` computations run at once, so a burst of requests can't starve the
+    server. Arguments must not be bound to the event loop thread e.g. sqlite connections.
+
+    :param func: computation to run
+    :return: result of the computation
+    """
+
+    def timed() -> tuple[R, float, float]:
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        return result, started, time.perf_counter()
+
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(MAX_CONCURRENCY, thread_name_prefix="wuzzln-compute")
+
+    submitted = time.perf_counter()
+    result, started, finished = await asyncio.get_running_loop().run_in_executor(executor, timed)
+
+    name = getattr(func, "__qualname__", repr(func))
+    queue_time = started - submitted
+    s = stats[name]
+    s.count += 1
+    s.queue_time += queue_time
+    s.max_queue_time = max(s.max_queue_time, queue_time)
+    s.run_time += finished - started
+    if queue_time > SLOW_QUEUE_TIME:
+        logger.warning("%s waited %.2fs for a free worker", name, queue_time)
+    logger.debug("%s queued %.3fs, ran %.3fs", name, queue_time, finished - started)
+
+    return result
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the worker processes, one less than CPUs since the caller keeps computing as well.
+
+    :return: long-lived process pool, reused across requests
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(
+                max((os.cpu_count() or 1) - 1, 1),
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return process_pool
+
+
+def shutdown_executor() -> None:
+    """Wait for running computations, stop the worker threads and processes and log stats."""
+    global executor, process_pool
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+    for name, s in sorted(stats.items()):
+        logger.info(
+            "%s ran %d times, queued %.3fs on average and %.3fs at most, ran %.3fs on average",
+            name,
+            s.count,
+            s.mean_queue_time,
+            s.max_queue_time,
+            s.run_time / s.count,
+        )
+    with process_pool_lock:
+        if process_pool is not None:
+            process_pool.shutdown(cancel_futures=True)
+            process_pool = None
@@ -0,0 +1,389 @@
+from typing import Iterator, Sequence
+
+# edge between vertex i and j with integer weight w
+type Edge = tuple[int, int, int]
+
+
+def max_weight_matching(edges: Sequence[Edge], max_cardinality: bool = False) -> list[int]:
+    """Find a maximum weight matching in a general graph with Edmonds' blossom algorithm.
+
+    Follows the O(n^3) primal-dual method of Galil, "Efficient algorithms for finding maximum
+    matching in graphs" (1986). Integer weights keep all dual variables integer, so there are no
+    rounding issues when comparing slacks.
+
+    :param edges: undirected edges (i, j, weight) with vertices numbered from 0
+    :param max_cardinality: only consider matchings with maximum number of edges
+    :return: mate of each vertex or -1 if unmatched
+    """
+    if not edges:
+        return []
+
+    edge_count = len(edges)
+    n = 1 + max(max(i, j) for i, j, _ in edges)
+    max_weight = max(0, *(w for _, _, w in edges))
+
+    # endpoint p of edge p // 2, so p ^ 1 is the other end of the same edge
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * edge_count)]
+    # remote endpoints of the edges incident to each vertex
+    neighbor_ends: list[list[int]] = [[] for _ in range(n)]
+    for k, (i, j, _) in enumerate(edges):
+        neighbor_ends[i].append(2 * k + 1)
+        neighbor_ends[j].append(2 * k)
+
+    # remote endpoint of the matched edge or -1
+    mate = [-1] * n
+    # vertices 0..n-1 and blossoms n..2n-1: 0 = free, 1 = S (outer), 2 = T (inner)
+    label = [0] * (2 * n)
+    # endpoint through which a vertex or blossom got its label
+    label_end = [-1] * (2 * n)
+    # top-level blossom of each vertex
+    in_blossom = list(range(n))
+    blossom_parent = [-1] * (2 * n)
+    blossom_children: list[list[int] | None] = [None] * (2 * n)
+    blossom_base = list(range(n)) + [-1] * n
+    # endpoints connecting consecutive children of a blossom
+    blossom_ends: list[list[int] | None] = [None] * (2 * n)
+    # least-slack edge to a different S-blossom for free vertices and S-blossoms
+    best_edge = [-1] * (2 * n)
+    blossom_best_edges: list[list[int] | None] = [None] * (2 * n)
+    unused_blossoms = list(range(n, 2 * n))
+    dual = [max_weight] * n + [0] * n
+    # edges with zero slack, usable to grow the alternating tree
+    allow_edge = [False] * edge_count
+    queue: list[int] = []
+
+    def slack(k: int) -> int:
+        i, j, w = edges[k]
+        return dual[i] + dual[j] - 2 * w
+
+    def leaves(b: int) -> Iterator[int]:
+        if b < n:
+            yield b
+        else:
+            for child in blossom_children[b] or ():
+                yield from leaves(child)
+
+    def assign_label(w: int, t: int, p: int) -> None:
+        b = in_blossom[w]
+        label[w] = label[b] = t
+        label_end[w] = label_end[b] = p
+        best_edge[w] = best_edge[b] = -1
+        if t == 1:
+            queue.extend(leaves(b))
+        else:
+            # the mate of a T-blossom's base becomes an S-vertex
+            base = blossom_base[b]
+            assign_label(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scan_blossom(v: int, w: int) -> int:
+        """Trace back from v and w to find a new blossom's base or -1 for an augmenting path."""
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = in_blossom[v]
+            if label[b] & 4:
+                base = blossom_base[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if label_end[b] == -1:
+                # reached the root of the tree
+                v = -1
+            else:
+                v = endpoint[label_end[b]]
+                b = in_blossom[v]
+                v = endpoint[label_end[b]]
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def add_blossom(base: int, k: int) -> None:
+        v, w, _ = edges[k]
+        bb, bv, bw = in_blossom[base], in_blossom[v], in_blossom[w]
+        b = unused_blossoms.pop()
+        blossom_base[b] = base
+        blossom_parent[b] = -1
+        blossom_parent[bb] = b
+        blossom_children[b] = path = []
+        blossom_ends[b] = ends = []
+        while bv != bb:
+            blossom_parent[bv] = b
+            path.append(bv)
+            ends.append(label_end[bv])
+            v = endpoint[label_end[bv]]
+            bv = in_blossom[v]
+        path.append(bb)
+        path.reverse()
+        ends.reverse()
+        ends.append(2 * k)
+        while bw != bb:
+            blossom_parent[bw] = b
+            path.append(bw)
+            ends.append(label_end[bw] ^ 1)
+            w = endpoint[label_end[bw]]
+            bw = in_blossom[w]
+
+        label[b] = 1
+        label_end[b] = label_end[bb]
+        dual[b] = 0
+        for v in leaves(b):
+            if label[in_blossom[v]] == 2:
+                # former T-vertices are now S-vertices
+                queue.append(v)
+            in_blossom[v] = b
+
+        # least-slack edges to other S-blossoms
+        best_edge_to = [-1] * (2 * n)
+        for bv in path:
+            if (child_best_edges := blossom_best_edges[bv]) is None:
+                edge_lists = [[p // 2 for p in neighbor_ends[v]] for v in leaves(bv)]
+            else:
+                edge_lists = [child_best_edges]
+            for edge_list in edge_lists:
+                for k in edge_list:
+                    i, j, _ = edges[k]
+                    if in_blossom[j] == b:
+                        i, j = j, i
+                    bj = in_blossom[j]
+                    if (
+                        bj != b
+                        and label[bj] == 1
+                        and (best_edge_to[bj] == -1 or slack(k) < slack(best_edge_to[bj]))
+                    ):
+                        best_edge_to[bj] = k
+            blossom_best_edges[bv] = None
+            best_edge[bv] = -1
+        blossom_best_edges[b] = [k for k in best_edge_to if k != -1]
+        best_edge[b] = -1
+        for k in blossom_best_edges[b] or ():
+            if best_edge[b] == -1 or slack(k) < slack(best_edge[b]):
+                best_edge[b] = k
+
+    def expand_blossom(b: int, end_stage: bool) -> None:
+        children = blossom_children[b] or []
+        ends = blossom_ends[b] or []
+        for s in children:
+            blossom_parent[s] = -1
+            if s < n:
+                in_blossom[s] = s
+            elif end_stage and dual[s] == 0:
+                expand_blossom(s, end_stage)
+            else:
+                for v in leaves(s):
+                    in_blossom[v] = s
+
+        if not end_stage and label[b] == 2:
+            # relabel the children on the even path from the entry child to the base
+            entry_child = in_blossom[endpoint[label_end[b] ^ 1]]
+            j = children.index(entry_child)
+            if j & 1:
+                j -= len(children)
+                step, trick = 1, 0
+            else:
+                step, trick = -1, 1
+            p = label_end[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[ends[j - trick] ^ trick ^ 1]] = 0
+                assign_label(endpoint[p ^ 1], 2, p)
+                allow_edge[ends[j - trick] // 2] = True
+                j += step
+                p = ends[j - trick] ^ trick
+                allow_edge[p // 2] = True
+                j += step
+            # base child becomes T without stepping through to its mate
+            bv = children[j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            label_end[endpoint[p ^ 1]] = label_end[bv] = p
+            best_edge[bv] = -1
+            # children on the odd path get labels from neighbors outside of the blossom
+            j += step
+            while children[j] != entry_child:
+                bv = children[j]
+                if label[bv] == 1:
+                    j += step
+                    continue
+                labeled = next((v for v in leaves(bv) if label[v] != 0), None)
+                if labeled is not None:
+                    label[labeled] = 0
+                    label[endpoint[mate[blossom_base[bv]]]] = 0
+                    assign_label(labeled, 2, label_end[labeled])
+                j += step
+
+        label[b] = label_end[b] = -1
+        blossom_children[b] = blossom_ends[b] = None
+        blossom_base[b] = -1
+        blossom_best_edges[b] = None
+        best_edge[b] = -1
+        unused_blossoms.append(b)
+
+    def augment_blossom(b: int, v: int) -> None:
+        """Swap matched and unmatched edges inside a blossom so that v becomes its base."""
+        t = v
+        while blossom_parent[t] != b:
+            t = blossom_parent[t]
+        if t >= n:
+            augment_blossom(t, v)
+        children = blossom_children[b] or []
+        ends = blossom_ends[b] or []
+        i = j = children.index(t)
+        if i & 1:
+            j -= len(children)
+            step, trick = 1, 0
+        else:
+            step, trick = -1, 1
+        while j != 0:
+            j += step
+            t = children[j]
+            p = ends[j - trick] ^ trick
+            if t >= n:
+                augment_blossom(t, endpoint[p])
+            j += step
+            t = children[j]
+            if t >= n:
+                augment_blossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossom_children[b] = children[i:] + children[:i]
+        blossom_ends[b] = ends[i:] + ends[:i]
+        blossom_base[b] = blossom_base[children[i]]
+
+    def augment_matching(k: int) -> None:
+        """Flip matched and unmatched edges along the augmenting path through edge k."""
+        v, w, _ = edges[k]
+        for s, p in (v, 2 * k + 1), (w, 2 * k):
+            while True:
+                bs = in_blossom[s]
+                if bs >= n:
+                    augment_blossom(bs, s)
+                mate[s] = p
+                if label_end[bs] == -1:
+                    # reached the root
+                    break
+                t = endpoint[label_end[bs]]
+                bt = in_blossom[t]
+                s = endpoint[label_end[bt]]
+                j = endpoint[label_end[bt] ^ 1]
+                if bt >= n:
+                    augment_blossom(bt, j)
+                mate[j] = label_end[bt]
+                p = label_end[bt] ^ 1
+
+    # each stage grows alternating trees from all free vertices until one augmentation
+    for _ in range(n):
+        label[:] = [0] * (2 * n)
+        best_edge[:] = [-1] * (2 * n)
+        blossom_best_edges[n:] = [None] * n
+        allow_edge[:] = [False] * edge_count
+        queue.clear()
+        for v in range(n):
+            if mate[v] == -1 and label[in_blossom[v]] == 0:
+                assign_label(v, 1, -1)
+
+        augmented = False
+        while True:
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbor_ends[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if in_blossom[v] == in_blossom[w]:
+                        continue
+                    k_slack = 0
+                    if not allow_edge[k]:
+                        k_slack = slack(k)
+                        if k_slack <= 0:
+                            allow_edge[k] = True
+                    if allow_edge[k]:
+                        if label[in_blossom[w]] == 0:
+                            assign_label(w, 2, p ^ 1)
+                        elif label[in_blossom[w]] == 1:
+                            base = scan_blossom(v, w)
+                            if base >= 0:
+                                add_blossom(base, k)
+                            else:
+                                augment_matching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            # w is inside a T-blossom but not yet reached from an S-vertex
+                            label[w] = 2
+                            label_end[w] = p ^ 1
+                    elif label[in_blossom[w]] == 1:
+                        b = in_blossom[v]
+                        if best_edge[b] == -1 or k_slack < slack(best_edge[b]):
+                            best_edge[b] = k
+                    elif label[w] == 0:
+                        if best_edge[w] == -1 or k_slack < slack(best_edge[w]):
+                            best_edge[w] = k
+
+            if augmented:
+                break
+
+            # no augmenting path with zero slack edges, so change the dual variables
+            delta_type = -1
+            delta = delta_edge = delta_blossom = 0
+            if not max_cardinality:
+                # minimum dual of S-vertices reaches zero
+                delta_type = 1
+                delta = min(dual[:n])
+            for v in range(n):
+                # free vertex gets a zero slack edge to an S-vertex
+                if label[in_blossom[v]] == 0 and best_edge[v] != -1:
+                    d = slack(best_edge[v])
+                    if delta_type == -1 or d < delta:
+                        delta, delta_type, delta_edge = d, 2, best_edge[v]
+            for b in range(2 * n):
+                # two S-blossoms get a zero slack edge between them
+                if blossom_parent[b] == -1 and label[b] == 1 and best_edge[b] != -1:
+                    d = slack(best_edge[b]) // 2
+                    if delta_type == -1 or d < delta:
+                        delta, delta_type, delta_edge = d, 3, best_edge[b]
+            for b in range(n, 2 * n):
+                # dual of a T-blossom reaches zero
+                if (
+                    blossom_base[b] >= 0
+                    and blossom_parent[b] == -1
+                    and label[b] == 2
+                    and (delta_type == -1 or dual[b] < delta)
+                ):
+                    delta, delta_type, delta_blossom = dual[b], 4, b
+            if delta_type == -1:
+                # maximum cardinality reached, finish with the optimal duals
+                delta_type = 1
+                delta = max(0, min(dual[:n]))
+
+            for v in range(n):
+                if label[in_blossom[v]] == 1:
+                    dual[v] -= delta
+                elif label[in_blossom[v]] == 2:
+                    dual[v] += delta
+            for b in range(n, 2 * n):
+                if blossom_base[b] >= 0 and blossom_parent[b] == -1:
+                    if label[b] == 1:
+                        dual[b] += delta
+                    elif label[b] == 2:
+                        dual[b] -= delta
+
+            if delta_type == 1:
+                break
+            elif delta_type in (2, 3):
+                allow_edge[delta_edge] = True
+                i, j, _ = edges[delta_edge]
+                if label[in_blossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            else:
+                expand_blossom(delta_blossom, False)
+
+        if not augmented:
+            break
+
+        # expand S-blossoms with zero dual, they are not needed anymore
+        for b in range(n, 2 * n):
+            if blossom_parent[b] == -1 and blossom_base[b] >= 0 and label[b] == 1 and dual[b] == 0:
+                expand_blossom(b, True)
+
+    return [endpoint[p] if p >= 0 else -1 for p in mate]
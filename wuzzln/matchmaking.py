@@ -1,11 +1,17 @@
+import heapq
 import math
+import os
 import random
-from functools import lru_cache
+import time
+from concurrent.futures import wait
 from itertools import chain, combinations, permutations
 from typing import Mapping, Sequence
 
 import trueskill as ts
 
+from wuzzln.executor import get_process_pool
+from wuzzln.matching import max_weight_matching
+
 type Team[Player] = tuple[Player, Player]
 
 # team assignment representation e.g. [def_a, off_a, def_b, off_b, ...]
@@ -38,21 +44,44 @@ def build_random_teams[P](players: Solution[P]) -> set[Team[P]]:
         return as_teams(players)
 
 
-def win_probability(team_a: Team[ts.Rating], team_b: Team[ts.Rating]) -> float:
+def win_probability(
+    team_a: Team[ts.Rating], team_b: Team[ts.Rating], env: ts.TrueSkill | None = None
+) -> float:
     """Probability of team a winning.
 
     :param team_a: player ratings for team a
     :param team_b: player ratings for team b
+    :param env: trueskill environment, defaults to global environment
     :return: win probability between 0 and 1 for team a
     """
+    ts_env = env or ts.global_env()
     delta_mu = sum(r.mu for r in team_a) - sum(r.mu for r in team_b)
     sum_sigma = sum(r.sigma**2 for r in chain(team_a, team_b))
     size = len(team_a) + len(team_b)
-    denominator = math.sqrt(size * ts.BETA**2 + sum_sigma)
-    ts_env = ts.global_env()
+    denominator = math.sqrt(size * ts_env.beta**2 + sum_sigma)
     return ts_env.cdf(delta_mu / denominator)
 
 
+def draw_probability(
+    team_a: Team[ts.Rating], team_b: Team[ts.Rating], env: ts.TrueSkill | None = None
+) -> float:
+    """Probability of a draw i.e. match quality.
+
+    Same as `ts.quality` for two teams, but without setting up matrices.
+
+    :param team_a: player ratings for team a
+    :param team_b: player ratings for team b
+    :param env: trueskill environment, defaults to global environment
+    :return: draw probability between 0 and 1
+    """
+    ts_env = env or ts.global_env()
+    delta_mu = sum(r.mu for r in team_a) - sum(r.mu for r in team_b)
+    sum_sigma = sum(r.sigma**2 for r in chain(team_a, team_b))
+    size_beta = (len(team_a) + len(team_b)) * ts_env.beta**2
+    denominator = size_beta + sum_sigma
+    return math.sqrt(size_beta / denominator) * math.exp(-(delta_mu**2) / (2 * denominator))
+
+
 def variety_2v2(
     defense: Sequence[ts.Rating],
     offense: Sequence[ts.Rating],
@@ -72,10 +101,12 @@ def variety_2v2(
     elif len(defense) != 4:
         raise NotImplementedError("Only for players allowed")
 
-    # if we have more than 4 then we need to average game quality across solution
-    # also currently computing twice (once for each side)
+    # for more than 4 players use the partner penalty of `exact_search` or `tabu_search`
     solutions: list[tuple[float, set[Team[int]]]] = []
     for d1, o1, d2, o2 in permutations(range(4), 4):
+        if (d1, o1) > (d2, o2):
+            # same matchup with sides switched
+            continue
         draw_prob: float = ts.quality([(defense[d1], offense[o1]), (defense[d2], offense[o2])])
         solutions.append((draw_prob, {(d1, o1), (d2, o2)}))
 
@@ -125,12 +156,99 @@ def push[K, V](ordered_set: dict[K, V], limit: int, key: K, value: V) -> None:
         del ordered_set[next(iter(ordered_set))]
 
 
+class DrawProbabilityMatrix:
+    """Squared draw probabilities of all matchups between teams of given players.
+
+    Team (i, j) with defense i and offense j is indexed as i * n + j. Rows are computed on first
+    access from summed team ratings, which is much cheaper than `draw_probability` per matchup.
+    """
+
+    def __init__(
+        self,
+        defense: Sequence[ts.Rating],
+        offense: Sequence[ts.Rating],
+        env: ts.TrueSkill | None = None,
+    ):
+        """Precompute team mean and variance.
+
+        :param defense: defense ratings for all players (n)
+        :param offense: offense ratings for all players (n)
+        :param env: trueskill environment, defaults to global environment
+        """
+        ts_env = env or ts.global_env()
+        self.size_beta = 4 * ts_env.beta**2
+        self.mu = [d.mu + o.mu for d in defense for o in offense]
+        self.var = [d.sigma**2 + o.sigma**2 for d in defense for o in offense]
+        self.rows: dict[int, list[float]] = {}
+
+    def row(self, team: int) -> list[float]:
+        """Squared draw probabilities of a team against all teams."""
+        if (row := self.rows.get(team)) is None:
+            row = self.rows[team] = self.against(self.mu[team], self.var[team])
+        return row
+
+    def against(self, mu: float, var: float) -> list[float]:
+        """Squared draw probabilities of all teams against a team with summed mean and variance."""
+        size_beta = self.size_beta
+        return [
+            size_beta / (denom := size_beta + var + var_b) * math.exp(-((mu - mu_b) ** 2) / denom)
+            for mu_b, var_b in zip(self.mu, self.var)
+        ]
+
+    def get(self, team_a: int, team_b: int) -> float:
+        """Squared draw probability of a single matchup."""
+        if (row := self.rows.get(team_a)) is not None:
+            return row[team_b]
+        delta_mu = self.mu[team_a] - self.mu[team_b]
+        denom = self.size_beta + self.var[team_a] + self.var[team_b]
+        return self.size_beta / denom * math.exp(-(delta_mu**2) / denom)
+
+
+def partner_penalty(
+    partner_count: Mapping[Team[int], int], n: int, weight: float = 0.1
+) -> list[float]:
+    """Fitness penalty of each team for how often its players already played together.
+
+    Counts are relative to the most common pair and scaled by the matchups a team is part of, so
+    `weight` is how much squared draw probability a matchup may lose for a new pair of players.
+
+    :param partner_count: how often players played together as (defense, offense) in any role
+    :param n: number of players
+    :param weight: importance of partner variety compared to draw probability
+    :return: penalty for each team (i, j) indexed as i * n + j
+    """
+    together = [
+        partner_count.get((i, j), 0) + partner_count.get((j, i), 0)
+        for i in range(n)
+        for j in range(n)
+    ]
+    most_common = max(together, default=0) or 1
+    matchups = n // 2 - 1
+    return [weight * matchups * count / most_common for count in together]
+
+
+def fitness(
+    draw_prob_sq: DrawProbabilityMatrix, teams: Sequence[int], penalty: Sequence[float]
+) -> float:
+    """Sum of squared draw probabilities between all team match ups minus team penalties.
+
+    :param draw_prob_sq: squared draw probabilities of all matchups
+    :param teams: teams (i, j) indexed as i * n + j
+    :param penalty: penalty of each team e.g. `partner_penalty`
+    :return: fitness of team assignment, higher is better
+    """
+    draw_prob = sum(draw_prob_sq.get(a, b) for a, b in combinations(teams, 2))
+    return draw_prob - sum(penalty[t] for t in teams)
+
+
 def tabu_search(
     defense: Sequence[ts.Rating],
     offense: Sequence[ts.Rating],
     k: int = 1,
     max_iter: int = 5000,
     tabu_size: int = 20,
+    deadline: float | None = None,
+    penalty: Sequence[float] | None = None,
 ) -> list[set[Team[int]]]:
     """Find pairings that result highest draw probability using Tabu Search.
 
@@ -139,6 +257,8 @@ def tabu_search(
     :param k: number of solutions to return
     :param max_iter: maximum search optimization steps
     :param tabu_size: last search steps to remember and not visit again
+    :param deadline: unix epoch timestamp after which to stop early
+    :param penalty: fitness penalty of each team (i, j) indexed as i * n + j e.g. `partner_penalty`
     :raise ValueError: incorrect number of ratings
     :return: top team assignments with players named by their index in `defense` and `offense`
     """
@@ -156,47 +276,301 @@ def tabu_search(
     elif len(defense) == 2:
         return [{(p, p) for p in random.sample([0, 1], 2)} for _ in range(k)]
 
-    @lru_cache(10_000)
-    def draw_prob(team_a: Team[int], team_b: Team[int]) -> float:
-        """Compute draw probability of matchup."""
-        return ts.quality(
-            [
-                (defense[team_a[0]], offense[team_a[1]]),
-                (defense[team_b[0]], offense[team_b[1]]),
-            ]
-        )
-
-    def fitness(solution: Solution[int]) -> float:
-        """Sum of squared draw probabilities between all team match ups."""
-        teams = sorted(as_teams(solution))  # sorting reduces cache misses for draw_prob
-        prob = sum(draw_prob(a, b) ** 2 for a, b in combinations(teams, 2))
-        return prob
+    n = len(defense)
+    draw_prob_sq = DrawProbabilityMatrix(defense, offense)
+    penalty = penalty or [0.0] * n * n
+    swaps = list(combinations(range(n), 2))
+    # random bits per (position, player) so the hash of a solution can be updated per swap,
+    # drawn from a separate generator to not change the course of the search
+    rand = random.Random(n)
+    zobrist = [[rand.getrandbits(64) for _ in range(n)] for _ in range(n)]
 
     # start with random solution
-    candidate = tuple(random.sample(range(len(defense)), len(defense)))
-    best_fitness = fitness(candidate)
+    candidate = random.sample(range(n), n)
+    teams = [candidate[i] * n + candidate[i + 1] for i in range(0, n, 2)]
+    candidate_hash = 0
+    for pos, p in enumerate(candidate):
+        candidate_hash ^= zobrist[pos][p]
+    candidate_fitness = fitness(draw_prob_sq, teams, penalty)
+    # summed squared draw probability of every possible team against the current teams
+    team_sum = [sum(col) for col in zip(*(draw_prob_sq.row(t) for t in teams))]
+
+    def swap(i: int, j: int) -> tuple[float, int, int, int]:
+        """Fitness change, hash and new teams of swapping players at positions i < j."""
+        a, b = candidate[i], candidate[j]
+        swapped_hash = (
+            candidate_hash ^ zobrist[i][a] ^ zobrist[i][b] ^ zobrist[j][b] ^ zobrist[j][a]
+        )
+        ti, tj = i // 2, j // 2
+        old_i, old_j = teams[ti], teams[tj]
+        row_i = draw_prob_sq.row(old_i)
+        if ti == tj:
+            # defense and offense switch
+            new_i = b * n + a
+            delta = team_sum[new_i] - row_i[new_i] - team_sum[old_i] + row_i[old_i]
+            delta -= penalty[new_i] - penalty[old_i]
+            return delta, swapped_hash, new_i, new_i
+        new_i = b * n + candidate[i + 1] if i % 2 == 0 else candidate[i - 1] * n + b
+        new_j = a * n + candidate[j + 1] if j % 2 == 0 else candidate[j - 1] * n + a
+        row_j = draw_prob_sq.row(old_j)
+        # new teams against all other teams and each other minus the same for the old teams
+        new_fitness_i = team_sum[new_i] - row_i[new_i] - row_j[new_i]
+        new_fitness_j = team_sum[new_j] - row_i[new_j] - row_j[new_j]
+        old_fitness = team_sum[old_i] - row_i[old_i] + team_sum[old_j] - row_j[old_j] - row_i[old_j]
+        delta = new_fitness_i + new_fitness_j + draw_prob_sq.get(new_i, new_j) - old_fitness
+        delta -= penalty[new_i] + penalty[new_j] - penalty[old_i] - penalty[old_j]
+        return delta, swapped_hash, new_i, new_j
+
+    best_fitness = candidate_fitness
     # using dicts for fast lookup + keeping order
-    best_candidates = {candidate: best_fitness}
-    tabu = {candidate: True}
+    best_candidates = {tuple(candidate): best_fitness}
+    tabu = {candidate_hash: True}
 
     for _ in range(max_iter):
-        neighborhood = swap_two_players_neighborhood(candidate)
+        if deadline is not None and time.time() > deadline:
+            break
+
         # if no better candidate found -> using random best candidate
-        candidate = random.choice(neighborhood)
-        candidate_fitness = fitness(candidate)
-        for neighbor in neighborhood:
-            if neighbor not in tabu:
-                neighbor_fitness = fitness(neighbor)
-                if neighbor_fitness > candidate_fitness:
-                    candidate = neighbor
-                    candidate_fitness = neighbor_fitness
+        move = random.choice(swaps)
+        delta, move_hash, new_i, new_j = swap(*move)
+        for i, j in swaps:
+            neighbor_delta, neighbor_hash, neighbor_i, neighbor_j = swap(i, j)
+            if neighbor_delta > delta and neighbor_hash not in tabu:
+                move = i, j
+                delta, move_hash, new_i, new_j = (
+                    neighbor_delta,
+                    neighbor_hash,
+                    neighbor_i,
+                    neighbor_j,
+                )
+
+        i, j = move
+        ti, tj = i // 2, j // 2
+        for t, new in {ti: new_i, tj: new_j}.items():
+            old_row, new_row = draw_prob_sq.row(teams[t]), draw_prob_sq.row(new)
+            team_sum = [s - o + w for s, o, w in zip(team_sum, old_row, new_row)]
+            teams[t] = new
+        candidate[i], candidate[j] = candidate[j], candidate[i]
+        candidate_hash = move_hash
+        candidate_fitness += delta
 
         if candidate_fitness > best_fitness:
-            best_fitness = candidate_fitness
-            # because we only add better candidates top_candidates keeps fitness order
-            push(best_candidates, k, candidate, candidate_fitness)
+            # recompute to not accumulate rounding errors of the deltas
+            candidate_fitness = fitness(draw_prob_sq, teams, penalty)
+            if candidate_fitness > best_fitness:
+                best_fitness = candidate_fitness
+                # because we only add better candidates top_candidates keeps fitness order
+                push(best_candidates, k, tuple(candidate), candidate_fitness)
 
         # maintain maximum tabu list size
-        push(tabu, tabu_size, candidate, True)
+        push(tabu, tabu_size, candidate_hash, True)
 
     return [as_teams(c) for c in reversed(best_candidates)]
+
+
+def seeded_tabu_search(
+    seed: int, defense: Sequence[ts.Rating], offense: Sequence[ts.Rating], **kwargs
+) -> list[set[Team[int]]]:
+    """Run `tabu_search` from a seeded random start, e.g. in a worker process."""
+    random.seed(seed)
+    return tabu_search(defense, offense, **kwargs)
+
+
+def multi_start_tabu_search(
+    defense: Sequence[ts.Rating],
+    offense: Sequence[ts.Rating],
+    k: int = 1,
+    time_budget: float = 1.0,
+    starts: int | None = None,
+    max_iter: int = 5000,
+    penalty: Sequence[float] | None = None,
+) -> list[set[Team[int]]]:
+    """Run independent tabu searches in parallel within a time budget and merge their results.
+
+    One search runs in the calling process, so there is a result in time even if worker processes
+    are slow to start.
+
+    :param defense: defense ratings for all players (n)
+    :param offense: offense ratings for all players (n)
+    :param k: number of solutions to return
+    :param time_budget: seconds until all searches stop
+    :param starts: number of searches, defaults to number of CPUs
+    :param max_iter: maximum search optimization steps per search
+    :param penalty: fitness penalty of each team (i, j) indexed as i * n + j e.g. `partner_penalty`
+    :raise ValueError: incorrect number of ratings
+    :return: top team assignments with players named by their index in `defense` and `offense`
+    """
+    deadline = time.time() + time_budget
+    starts = starts or os.cpu_count() or 1
+    kwargs = {"k": k, "max_iter": max_iter, "deadline": deadline, "penalty": penalty}
+
+    futures = []
+    if starts > 1:
+        # submitted searches stop at the deadline by themselves
+        pool = get_process_pool()
+        futures = [
+            pool.submit(seeded_tabu_search, random.getrandbits(64), defense, offense, **kwargs)
+            for _ in range(starts - 1)
+        ]
+
+    results = tabu_search(defense, offense, **kwargs)
+    # grace period for workers returning their results
+    done, not_done = wait(futures, timeout=max(deadline - time.time(), 0) + 0.1)
+    for f in done:
+        if f.exception() is None:
+            results.extend(f.result())
+    # searches still queued behind other requests would only start after the deadline
+    for f in not_done:
+        f.cancel()
+
+    n = len(defense)
+    draw_prob_sq = DrawProbabilityMatrix(defense, offense)
+    penalty = penalty or [0.0] * n * n
+    result_fitness = {
+        frozenset(teams): fitness(draw_prob_sq, [d * n + o for d, o in teams], penalty)
+        for teams in results
+    }
+    best = sorted(result_fitness, key=lambda teams: result_fitness[teams], reverse=True)
+    return [set(teams) for teams in best[:k]]
+
+
+# above this many players there are too many team assignments to try all of them
+EXACT_SEARCH_MAX_PLAYERS = 10
+
+
+def exact_search(
+    defense: Sequence[ts.Rating],
+    offense: Sequence[ts.Rating],
+    k: int = 1,
+    penalty: Sequence[float] | None = None,
+) -> list[set[Team[int]]]:
+    """Find pairings that result in the highest draw probability by trying all of them.
+
+    Uses the same fitness as `tabu_search`. There are (n-1)!! * 2^(n/2) assignments (30240 for
+    10 players), so this is only feasible for few players.
+
+    :param defense: defense ratings for all players (n)
+    :param offense: offense ratings for all players (n)
+    :param k: number of solutions to return
+    :param penalty: fitness penalty of each team (i, j) indexed as i * n + j e.g. `partner_penalty`
+    :raise ValueError: incorrect number of ratings
+    :return: top team assignments with players named by their index in `defense` and `offense`
+    """
+    if k < 1:
+        raise ValueError("k < 1 returns no solutions")
+    elif len(defense) != len(offense):
+        raise ValueError("Each player must have defense and offense rating")
+    elif len(defense) < 2:
+        return []
+    elif len(defense) == 2:
+        return [{(0, 0), (1, 1)}]
+    elif len(defense) % 2 != 0:
+        raise ValueError("Only even number of players supported")
+
+    # squared draw probability for all matchups with team (i, j) indexed as i * n + j
+    n = len(defense)
+    draw_prob_sq = DrawProbabilityMatrix(defense, offense)
+    penalty = penalty or [0.0] * n * n
+
+    # min heap of the k best (fitness, teams) so far
+    best: list[tuple[float, tuple[Team[int], ...]]] = []
+    teams: list[Team[int]] = []
+    team_idx: list[int] = []
+
+    def search(remaining: tuple[int, ...], partial_fitness: float) -> None:
+        if not remaining:
+            if len(best) < k:
+                heapq.heappush(best, (partial_fitness, tuple(sorted(teams))))
+            elif partial_fitness > best[0][0]:
+                heapq.heapreplace(best, (partial_fitness, tuple(sorted(teams))))
+            return
+
+        # first remaining player is always part of the next team, so each assignment is
+        # visited exactly once
+        p = remaining[0]
+        for i in range(1, len(remaining)):
+            rest = remaining[1:i] + remaining[i + 1 :]
+            for team in (p, remaining[i]), (remaining[i], p):
+                idx = team[0] * n + team[1]
+                team_draw_prob_sq = draw_prob_sq.row(idx)
+                team_fitness = sum(team_draw_prob_sq[t] for t in team_idx) - penalty[idx]
+                teams.append(team)
+                team_idx.append(idx)
+                search(rest, partial_fitness + team_fitness)
+                teams.pop()
+                team_idx.pop()
+
+    search(tuple(range(len(defense))), 0)
+    return [set(t) for _, t in sorted(best, reverse=True)]
+
+
+# draw probabilities are scaled to integer weights for `max_weight_matching`
+MATCHING_WEIGHT_SCALE = 10**9
+
+
+def matching_search(
+    defense: Sequence[ts.Rating],
+    offense: Sequence[ts.Rating],
+    penalty: Sequence[float] | None = None,
+) -> list[tuple[Team[int], Team[int]]]:
+    """Form teams and then pair teams into games, both by maximum weight matching.
+
+    Teams are formed of players whose combined rating is closest to the average team, then each
+    team gets the opponent with the highest draw probability overall. Both steps are polynomial
+    and deterministic, so this works for groups too large to search all team assignments. With an
+    odd number of teams, the left over team additionally plays its best opponent.
+
+    :param defense: defense ratings for all players (n)
+    :param offense: offense ratings for all players (n)
+    :param penalty: fitness penalty of each team (i, j) indexed as i * n + j e.g. `partner_penalty`
+    :raise ValueError: incorrect number of ratings
+    :return: games between two teams with players named by their index in `defense` and `offense`
+    """
+    if len(defense) != len(offense):
+        raise ValueError("Each player must have defense and offense rating")
+    elif len(defense) < 2:
+        return []
+    elif len(defense) == 2:
+        return [((0, 0), (1, 1))]
+    elif len(defense) % 2 != 0:
+        raise ValueError("Only even number of players supported")
+
+    n = len(defense)
+    draw_prob_sq = DrawProbabilityMatrix(defense, offense)
+    penalty = penalty or [0.0] * n * n
+
+    # squared draw probability against an average team for all matchups the team is part of
+    matchups = n // 2 - 1
+    mu_avg = sum(d.mu + o.mu for d, o in zip(defense, offense)) / n
+    var_avg = sum(d.sigma**2 + o.sigma**2 for d, o in zip(defense, offense)) / n
+    team_weight = [
+        matchups * prob - pen for prob, pen in zip(draw_prob_sq.against(mu_avg, var_avg), penalty)
+    ]
+
+    # phase 1: pair up players, each pair in its better defense/offense orientation
+    orientation = {}
+    player_edges = []
+    for i, j in combinations(range(n), 2):
+        team = max((i, j), (j, i), key=lambda t: team_weight[t[0] * n + t[1]])
+        orientation[i, j] = team
+        weight = round(team_weight[team[0] * n + team[1]] * MATCHING_WEIGHT_SCALE)
+        player_edges.append((i, j, weight))
+    mate = max_weight_matching(player_edges, max_cardinality=True)
+    teams = [orientation[i, j] for i, j in enumerate(mate) if i < j]
+
+    # phase 2: pair up teams by draw probability
+    team_idx = [d * n + o for d, o in teams]
+    team_edges = [
+        (a, b, round(draw_prob_sq.get(team_idx[a], team_idx[b]) * MATCHING_WEIGHT_SCALE))
+        for a, b in combinations(range(len(teams)), 2)
+    ]
+    mate = max_weight_matching(team_edges, max_cardinality=True)
+    games = [(teams[a], teams[b]) for a, b in enumerate(mate) if a < b]
+    for a in (a for a, b in enumerate(mate) if b == -1):
+        b = max(
+            (b for b in range(len(teams)) if b != a),
+            key=lambda b: draw_prob_sq.get(team_idx[a], team_idx[b]),
+        )
+        games.append((teams[a], teams[b]))
+
+    return games
@@ -1,9 +1,12 @@
-from collections import defaultdict
+import math
+from array import array
 from functools import lru_cache
+from itertools import chain
+from typing import Iterable, Iterator, Mapping, MutableMapping, NamedTuple, Sequence
 
 import trueskill as ts
 
-from wuzzln.data import Game, PlayerId, Rank, Rating
+from wuzzln.data import Game, PlayerId, Rank, Rating, SeasonId, Timestamp
 
 
 def get_rank(trueskill_mean: float) -> Rank:
@@ -23,70 +26,312 @@ def get_rank(trueskill_mean: float) -> Rank:
         return Rank.IMMORTAL
 
 
-@lru_cache(2)
-def compute_ratings(games_sorted: tuple[Game, ...]) -> list[Rating]:
-    """Compute rating history.
+def rate_2v2(
+    team_a: tuple[ts.Rating, ts.Rating],
+    team_b: tuple[ts.Rating, ts.Rating],
+    score_a: int,
+    score_b: int,
+    env: ts.TrueSkill | None = None,
+) -> tuple[tuple[ts.Rating, ts.Rating], tuple[ts.Rating, ts.Rating]]:
+    """Rate a game between two teams of two.
 
-    :param games_sorted: games sorted by time (tuple allows caching!)
-    :return: ratings sorted by time
+    Equivalent to `ts.rate` but without building a factor graph, because with only two teams
+    and no draw the message passing reduces to a single closed-form update.
+
+    :param team_a: ratings of team a
+    :param team_b: ratings of team b
+    :param score_a: score of team a
+    :param score_b: score of team b
+    :param env: trueskill environment, defaults to global environment
+    :return: new ratings of team a and team b
     """
-    def_rat = defaultdict(ts.Rating)
-    off_rat = defaultdict(ts.Rating)
-    hist = []
+    ts_env: ts.TrueSkill = env if env is not None else ts.global_env()
+    if score_a == score_b:
+        (a1, a2), (b1, b2) = ts_env.rate([team_a, team_b], [-score_a, -score_b])
+        return (a1, a2), (b1, b2)
 
-    for g in games_sorted:
-        def_a, off_a, def_b, off_b = g.defense_a, g.offense_a, g.defense_b, g.offense_b
-        team_a = def_rat[def_a], off_rat[off_a]
-        team_b = def_rat[def_b], off_rat[off_b]
+    winner, loser = (team_a, team_b) if score_a > score_b else (team_b, team_a)
+    tau_sq = ts_env.tau**2
+    var = [r.sigma**2 + tau_sq for r in chain(winner, loser)]
+    c_sq = sum(var) + 4 * ts_env.beta**2
+    c = math.sqrt(c_sq)
+    draw_margin = ts.calc_draw_margin(ts_env.draw_probability, 4, ts_env)
+    diff = (winner[0].mu + winner[1].mu - loser[0].mu - loser[1].mu) / c
+    v = ts_env.v_win(diff, draw_margin / c)
+    w = ts_env.w_win(diff, draw_margin / c)
 
-        (def_a_rat, off_a_rat), (def_b_rat, off_b_rat) = ts.rate(
-            [team_a, team_b], [-g.score_a, -g.score_b]
+    rated = [
+        ts.Rating(
+            r.mu + sign * (r_var / c) * v,
+            math.sqrt(r_var * (1 - (r_var / c_sq) * w)),
         )
-        def_rat[def_a] = def_a_rat
-        off_rat[off_a] = off_a_rat
-        def_rat[def_b] = def_b_rat
-        off_rat[off_b] = off_b_rat
-
-        players_ratings = [
-            (def_a, def_a_rat, off_rat[def_a]),
-            (def_b, def_b_rat, off_rat[def_b]),
-        ]
-        # avoid duplicate ratings in case 1v1 game
-        if def_a != off_a:
-            players_ratings.append((off_a, def_rat[off_a], off_a_rat))
-        if def_b != off_b:
-            players_ratings.append((off_b, def_rat[off_b], off_b_rat))
-
-        for player, pdr, por in players_ratings:
-            pd_skill = ts.expose(pdr)
-            po_skill = ts.expose(por)
-            p_skill = (pd_skill + po_skill) / 2
-            hist.append(
-                Rating(
-                    g.season,
-                    player,
-                    g.timestamp,
-                    p_skill,
-                    pd_skill,
-                    pdr.mu,
-                    pdr.sigma,
-                    po_skill,
-                    por.mu,
-                    por.sigma,
-                )
+        for r, r_var, sign in zip(chain(winner, loser), var, (1, 1, -1, -1))
+    ]
+    new_winner, new_loser = (rated[0], rated[1]), (rated[2], rated[3])
+    return (new_winner, new_loser) if score_a > score_b else (new_loser, new_winner)
+
+
+def rate_game(
+    game: Game,
+    def_rat: MutableMapping[PlayerId, ts.Rating],
+    off_rat: MutableMapping[PlayerId, ts.Rating],
+    env: ts.TrueSkill | None = None,
+) -> list[Rating]:
+    """Rate a single game and update the ratings of its players in place.
+
+    :param game: game to rate
+    :param def_rat: defense rating of each player (missing players get a default rating)
+    :param off_rat: offense rating of each player (missing players get a default rating)
+    :param env: trueskill environment, defaults to global environment
+    :return: new ratings of the players in the game
+    """
+    ts_env: ts.TrueSkill = env if env is not None else ts.global_env()
+    new = ts_env.create_rating()
+    g = game
+    def_a, off_a, def_b, off_b = g.defense_a, g.offense_a, g.defense_b, g.offense_b
+    team_a = def_rat.get(def_a, new), off_rat.get(off_a, new)
+    team_b = def_rat.get(def_b, new), off_rat.get(off_b, new)
+
+    (def_a_rat, off_a_rat), (def_b_rat, off_b_rat) = rate_2v2(
+        team_a, team_b, g.score_a, g.score_b, ts_env
+    )
+    def_rat[def_a] = def_a_rat
+    off_rat[off_a] = off_a_rat
+    def_rat[def_b] = def_b_rat
+    off_rat[off_b] = off_b_rat
+
+    players_ratings = [
+        (def_a, def_a_rat, off_rat.get(def_a, new)),
+        (def_b, def_b_rat, off_rat.get(def_b, new)),
+    ]
+    # avoid duplicate ratings in case 1v1 game
+    if def_a != off_a:
+        players_ratings.append((off_a, def_rat.get(off_a, new), off_a_rat))
+    if def_b != off_b:
+        players_ratings.append((off_b, def_rat.get(off_b, new), off_b_rat))
+
+    ratings = []
+    for player, pdr, por in players_ratings:
+        pd_skill = ts_env.expose(pdr)
+        po_skill = ts_env.expose(por)
+        p_skill = (pd_skill + po_skill) / 2
+        ratings.append(
+            Rating(
+                g.season,
+                player,
+                g.timestamp,
+                p_skill,
+                pd_skill,
+                pdr.mu,
+                pdr.sigma,
+                po_skill,
+                por.mu,
+                por.sigma,
             )
+        )
+
+    return ratings
+
+
+class RatingHistory:
+    """Ratings of a season stored column by column.
+
+    Player ids are interned and every rating only takes a few machine words instead of a tuple
+    of float objects. The latest ratings are tracked per player, so looking them up doesn't scan
+    the history.
+    """
+
+    def __init__(self, season: SeasonId | None = None) -> None:
+        self.season = season
+        self.players: list[PlayerId] = []
+        self.player_idx: dict[PlayerId, int] = {}
+        self.player = array("i")
+        self.timestamp = array("d")
+        self.overall = array("d")
+        self.defense = array("d")
+        self.defense_mu = array("d")
+        self.defense_sigma = array("d")
+        self.offense = array("d")
+        self.offense_mu = array("d")
+        self.offense_sigma = array("d")
+        # position of latest and previous rating for each interned player (-1 if none)
+        self.last = array("i")
+        self.prev = array("i")
+
+    def __len__(self) -> int:
+        return len(self.player)
+
+    def __getitem__(self, i: int) -> Rating:
+        return Rating(
+            self.season,  # type: ignore
+            self.players[self.player[i]],
+            self.timestamp[i],
+            self.overall[i],
+            self.defense[i],
+            self.defense_mu[i],
+            self.defense_sigma[i],
+            self.offense[i],
+            self.offense_mu[i],
+            self.offense_sigma[i],
+        )
+
+    def __iter__(self) -> Iterator[Rating]:
+        return (self[i] for i in range(len(self)))
+
+    def append(self, rating: Rating) -> None:
+        """Add rating which is newer than all ratings so far.
+
+        :param rating: rating of this season
+        """
+        if self.season is None:
+            self.season = rating.season
+        elif rating.season != self.season:
+            raise ValueError(f"Rating of season {rating.season} in history of {self.season}")
+
+        if (p := self.player_idx.get(rating.player)) is None:
+            p = self.player_idx[rating.player] = len(self.players)
+            self.players.append(rating.player)
+            self.last.append(-1)
+            self.prev.append(-1)
+
+        self.prev[p] = self.last[p]
+        self.last[p] = len(self)
+        self.player.append(p)
+        self.timestamp.append(rating.timestamp)
+        self.overall.append(rating.overall)
+        self.defense.append(rating.defense)
+        self.defense_mu.append(rating.defense_mu)
+        self.defense_sigma.append(rating.defense_sigma)
+        self.offense.append(rating.offense)
+        self.offense_mu.append(rating.offense_mu)
+        self.offense_sigma.append(rating.offense_sigma)
+
+    def extend(self, ratings: Iterable[Rating]) -> None:
+        for r in ratings:
+            self.append(r)
+
+    def latest(self) -> dict[PlayerId, Rating]:
+        """Get latest rating of each player."""
+        return {self.players[p]: self[i] for p, i in enumerate(self.last)}
 
+    def previous(self) -> dict[PlayerId, Rating]:
+        """Get rating of each player before their latest one (if there is one)."""
+        return {self.players[p]: self[i] for p, i in enumerate(self.prev) if i >= 0}
+
+
+@lru_cache(2)
+def compute_ratings(games_sorted: tuple[Game, ...]) -> RatingHistory:
+    """Compute rating history by replaying all games.
+
+    This is the reference implementation, :class:`RatingState` gives the same ratings
+    incrementally.
+
+    :param games_sorted: games of a season sorted by time (tuple allows caching!)
+    :return: ratings sorted by time
+    """
+    def_rat: dict[PlayerId, ts.Rating] = {}
+    off_rat: dict[PlayerId, ts.Rating] = {}
+    hist = RatingHistory()
+    for g in games_sorted:
+        hist.extend(rate_game(g, def_rat, off_rat))
     return hist
 
 
-def get_latest_rating(games_sorted: tuple[Game, ...]) -> dict[PlayerId, Rating]:
+class RatingState:
+    """Current ratings of a season which can be advanced one game at a time.
+
+    Only the players of a new game are touched, therefore adding a game doesn't depend on the
+    number of games in the season.
+    """
+
+    def __init__(
+        self, latest: Mapping[PlayerId, Rating] | None = None, env: ts.TrueSkill | None = None
+    ) -> None:
+        """Create rating state.
+
+        :param latest: latest rating of each player to continue from, defaults to new season
+        :param env: trueskill environment, defaults to global environment
+        """
+        self.env = env
+        self.latest: dict[PlayerId, Rating] = dict(latest or {})
+        self.previous: dict[PlayerId, Rating] = {}  # rating before the latest one
+        self.defense = {p: ts.Rating(r.defense_mu, r.defense_sigma) for p, r in self.latest.items()}
+        self.offense = {p: ts.Rating(r.offense_mu, r.offense_sigma) for p, r in self.latest.items()}
+
+    def update(self, game: Game) -> list[Rating]:
+        """Advance ratings of the players in a game.
+
+        :param game: game played after all games seen so far
+        :return: new ratings of the players in the game
+        """
+        ratings = rate_game(game, self.defense, self.offense, self.env)
+        for r in ratings:
+            if r.player in self.latest:
+                self.previous[r.player] = self.latest[r.player]
+            self.latest[r.player] = r
+        return ratings
+
+
+class Prospect(NamedTuple):
+    """Rating of a player after a game for both outcomes."""
+
+    rank: Rank  # before the game
+    win: Rating
+    loss: Rating
+
+    @property
+    def rank_up(self) -> bool:
+        return get_rank(self.win.overall).value > self.rank.value
+
+    @property
+    def rank_down(self) -> bool:
+        return get_rank(self.loss.overall).value < self.rank.value
+
+
+def predict_ratings(
+    latest: Mapping[PlayerId, Rating],
+    matchups: Iterable[tuple[PlayerId, PlayerId, PlayerId, PlayerId]],
+    season: SeasonId,
+    timestamp: Timestamp,
+) -> list[dict[PlayerId, Prospect]]:
+    """Compute ratings after prospective games without changing any state.
+
+    :param latest: current rating of each player
+    :param matchups: defense a, offense a, defense b, offense b of each game
+    :param season: season of the games
+    :param timestamp: time of the games
+    :return: prospect of each player for each matchup
+    """
+    prospects = []
+    for def_a, off_a, def_b, off_b in matchups:
+        players = {def_a, off_a, def_b, off_b}
+        outcomes = []
+        for score_a, score_b in (1, 0), (0, 1):
+            def_rat, off_rat = {}, {}
+            for p in players:
+                if r := latest.get(p):
+                    def_rat[p] = ts.Rating(r.defense_mu, r.defense_sigma)
+                    off_rat[p] = ts.Rating(r.offense_mu, r.offense_sigma)
+            game = Game("", timestamp, "", season, def_a, off_a, def_b, off_b, score_a, score_b)
+            outcomes.append({r.player: r for r in rate_game(game, def_rat, off_rat)})
+
+        a_wins, b_wins = outcomes
+        prospect = {}
+        for p in players:
+            rank = get_rank(latest[p].overall if p in latest else 0)
+            if p in (def_a, off_a):
+                prospect[p] = Prospect(rank, a_wins[p], b_wins[p])
+            else:
+                prospect[p] = Prospect(rank, b_wins[p], a_wins[p])
+        prospects.append(prospect)
+
+    return prospects
+
+
+def get_latest_rating(games_sorted: Sequence[Game]) -> dict[PlayerId, Rating]:
     """Get latest rating.
 
     :param games_sorted: games sorted by timestamp
     :return: player to rating mapping
     """
-    last_rating = {}
-    for r in reversed(compute_ratings(games_sorted)):
-        if r.player not in last_rating:
-            last_rating[r.player] = r
-    return last_rating
+    return compute_ratings(tuple(games_sorted)).latest()
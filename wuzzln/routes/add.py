@@ -1,27 +1,34 @@
-import sqlite3
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Annotated
 from uuid import uuid4
 
 from litestar import Response, delete, get, post
-from litestar.datastructures.state import ImmutableState
+from litestar.di import Provide
 from litestar.enums import RequestEncodingType
 from litestar.params import Body
 from litestar.response import Template
 
 from wuzzln import toast
-from wuzzln.data import Game, PlayerId, get_season
-from wuzzln.database import exists, insert
+from wuzzln.data import Game, OrgId, PlayerId, get_season, validate_game
+from wuzzln.database import (
+    AsyncConnection,
+    get_write_database,
+    insert,
+    insert_ratings,
+    insert_stats,
+    query_matchmakings,
+    query_player_names,
+    rebuild_ratings,
+    rebuild_stats,
+)
+from wuzzln.routes.matchmaking import matchmaking_cache
 
 
 @get("/add")
-async def get_add_game_page(
-    db: sqlite3.Connection, now: datetime, state: ImmutableState
-) -> Template:
-    player_name = dict(db.execute("SELECT id, name FROM player WHERE active = true"))
-    hour_ago = (now - timedelta(hours=1)).timestamp()
-    matchups = [m for m in state["matchmakings"] if m.timestamp > hour_ago]
+async def get_add_game_page(db: AsyncConnection, org: OrgId, now: datetime) -> Template:
+    player_name = await db.run(query_player_names, org, active=True)
+    matchups = await db.run(query_matchmakings, org, now.timestamp())
     return Template("add.html", context={"player_name": player_name, "matchmakings": matchups})
 
 
@@ -36,55 +43,67 @@ class GameDTO:
 
 
 # using 200 instead of 204 so we can return an empty response for htmx DOM swap
-@delete("/api/game/delete/{id:str}", status_code=200)
-async def delete_game(id: str, db: sqlite3.Connection, now: datetime) -> Response:
+@delete(
+    "/api/game/delete/{id:str}",
+    status_code=200,
+    dependencies={"db": Provide(get_write_database)},
+)
+async def delete_game(id: str, db: AsyncConnection, org: OrgId, now: datetime) -> Response:
     ten_min_ago = (now - timedelta(minutes=10)).timestamp()
-    db.execute("DELETE FROM game WHERE id = ? AND timestamp > ?", (id, ten_min_ago))
-    db.commit()
+    query = """
+        DELETE FROM main.game WHERE id = ? AND org = ? AND timestamp > ?
+        RETURNING season, timestamp
+    """
+    if deleted := await db.fetchone(query, (id, org, ten_min_ago)):
+        season, timestamp = deleted
+        await db.run(rebuild_ratings, org, season, since=timestamp)
+        await db.run(rebuild_stats, org, season)
+    await db.commit()
+    matchmaking_cache.pop(org, None)
     return Response("")
 
 
-@post("/api/game/create")
+@post("/api/game/create", dependencies={"db": Provide(get_write_database)})
 async def add_game(
     data: Annotated[GameDTO, Body(media_type=RequestEncodingType.URL_ENCODED)],
-    db: sqlite3.Connection,
+    db: AsyncConnection,
+    org: OrgId,
     now: datetime,
 ) -> Template:
     g = data
-    if not (0 <= g.score_a <= 10 and 0 <= g.score_b <= 10):
-        return toast.error("Score must be between 0 and 10")
-    elif g.score_a == g.score_b:
-        return toast.error("Games cannot end in draw")
-
     # 1v1s don't need to specify both players (this also works for empty strings!)
-    def_a = g.defense_a or g.offense_a
-    off_a = g.offense_a or g.defense_a
-    def_b = g.defense_b or g.offense_b
-    off_b = g.offense_b or g.defense_b
-
-    if not (def_a and off_a and def_b and off_b):
-        return toast.error("Each side must have at least one player")
-
-    if {def_a, off_a} & {def_b, off_b}:
-        return toast.error("Players must not play in both teams")
-
-    for p in def_a, off_a, def_b, off_b:
-        if not exists(db, "player", "id", p):
-            return toast.error("Unknown player")
-
     game = Game(
         str(uuid4()),
         now.timestamp(),
-        "org",  # FIXME: organization placeholder
+        org,
         get_season(now),
-        def_a,
-        off_a,
-        def_b,
-        off_b,
+        g.defense_a or g.offense_a,
+        g.offense_a or g.defense_a,
+        g.defense_b or g.offense_b,
+        g.offense_b or g.defense_b,
         g.score_a,
         g.score_b,
     )
-    insert(db, game)
-    db.commit()
+    if error := validate_game(game):
+        return toast.error(error)
+
+    # players of other orgs are unknown as well
+    player_name = await db.run(query_player_names, org)
+    for p in game.defense_a, game.offense_a, game.defense_b, game.offense_b:
+        if p not in player_name:
+            return toast.error("Unknown player")
+
+    await db.run(insert, game)
+    # `now` is taken before waiting for a write connection, so a concurrent add may have committed
+    # a later game first, then the games after this one are rated again
+    query = "SELECT 1 FROM main.game WHERE org = ? AND season = ? AND timestamp > ? LIMIT 1"
+    if await db.fetchone(query, (org, game.season, game.timestamp)):
+        await db.run(rebuild_ratings, org, game.season, since=game.timestamp)
+        await db.run(rebuild_stats, org, game.season)
+    else:
+        await db.run(insert_ratings, game)
+        await db.run(insert_stats, game)
+    await db.commit()
+    matchmaking_cache.pop(org, None)
 
     return toast.success("Game successfully added")
@@ -1,19 +1,21 @@
-import sqlite3
 from datetime import datetime, timedelta
 
 from litestar import Request, get
 from litestar.datastructures import Cookie
 from litestar.response import Template
 
-from wuzzln.data import Game, get_season
+from wuzzln.data import OrgId, get_season
+from wuzzln.database import AsyncConnection, query_player_names, query_season_games
 
 
 @get("/history")
-async def get_history_page(request: Request, db: sqlite3.Connection, now: datetime) -> Template:
+async def get_history_page(
+    request: Request, db: AsyncConnection, org: OrgId, now: datetime
+) -> Template:
     season = get_season(now)
-    query = "SELECT * FROM game WHERE timestamp < ? AND season = ? ORDER BY timestamp DESC"
-    games = [Game(*row) for row in db.execute(query, (now.timestamp(), season))]
-    player_name = dict(db.execute("SELECT id, name FROM player"))
+    season_games = await db.run(query_season_games, org, season)
+    games = [g for g in reversed(season_games) if g.timestamp < now.timestamp()]
+    player_name = await db.run(query_player_names, org)
     ten_min_ago = (now - timedelta(minutes=10)).timestamp()
 
     try:
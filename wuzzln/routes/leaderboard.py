@@ -1,4 +1,3 @@
-import sqlite3
 from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -7,14 +6,16 @@ from typing import Mapping, NamedTuple
 from litestar import Request, get
 from litestar.response import Redirect, Template
 
-from wuzzln.data import Game, PlayerId, Rank, get_season
-from wuzzln.database import query_game_count
-from wuzzln.rating import compute_ratings, get_rank
-from wuzzln.statistics import (
-    compute_game_count,
-    compute_streak,
-    compute_zero_score_count,
+from wuzzln.data import OrgId, PlayerId, PlayerStats, Rank, Rating, get_season
+from wuzzln.database import (
+    AsyncConnection,
+    query_latest_rating,
+    query_player_names,
+    query_previous_rating,
+    query_recent_game_count,
+    query_stats,
 )
+from wuzzln.rating import get_rank
 from wuzzln.utils import is_season_start
 
 
@@ -36,29 +37,22 @@ class LeaderboardEntry:
 
 
 def build_leaderboard(
-    games_sorted: tuple[Game, ...],
+    stats: Mapping[PlayerId, PlayerStats],
+    recent_game_count: Counter[PlayerId],
+    cur_rat: Mapping[PlayerId, Rating],
+    prev_rat: Mapping[PlayerId, Rating],
     player_name: Mapping[PlayerId, str],
-    prior_game_count: Counter[PlayerId],
-    now: datetime,
 ) -> dict[PlayerId, LeaderboardEntry]:
-    """Build leaderboard without badges.
+    """Build leaderboard with badges.
 
-    :param games_sorted: all games played sorted by timestamp
+    :param stats: statistics of each player in the season
+    :param recent_game_count: number of games played in the last two weeks
+    :param cur_rat: latest rating of each player
+    :param prev_rat: rating of each player before their latest game
     :param player_name: names of players for each player id
-    :param prior_game_count: number of games played before `games_sorted`
-    :param now: current time
     :return: player to leaderboard entry mapping
     """
-    ratings = compute_ratings(games_sorted)
-
-    diffs, cur_rat = {}, {}
-    for r in reversed(ratings):
-        if r.player not in diffs:
-            if r.player in cur_rat:
-                cur_rat_overall = cur_rat[r.player].overall
-                diffs[r.player] = cur_rat_overall - r.overall
-            else:
-                cur_rat[r.player] = r
+    diffs = {p: cur_rat[p].overall - r.overall for p, r in prev_rat.items()}
 
     leaderboard: dict[PlayerId, LeaderboardEntry] = {}
     sorted_rat = sorted(cur_rat.items(), key=lambda x: x[1].overall, reverse=True)
@@ -85,22 +79,21 @@ def build_leaderboard(
             badge = Badge("🦄", f"One-trick Pony: {text}")
             e.badges.append(badge)
 
-    if game_count := compute_game_count(games_sorted):
-        for e in leaderboard.values():
-            total_games = game_count[e.player] + prior_game_count[e.player]
+    for e in leaderboard.values():
+        if s := stats.get(e.player):
+            total_games = s.prior_game_count + s.game_count
             if total_games < 25:
                 badge = Badge("🐣", f"Chick: Practiced {total_games} times so far")
                 e.badges.append(badge)
 
-    ts_2w_ago = (now - timedelta(weeks=2)).timestamp()
-    games_2w = (g for g in games_sorted if g.timestamp > ts_2w_ago)
-    if game_count_2w := compute_game_count(games_2w):
-        player, count = game_count_2w.most_common(1)[0]
+    if recent_game_count:
+        player, count = recent_game_count.most_common(1)[0]
         if count > 10:
             badge = Badge("🛌", f"Sleeps in the office: Asked {count} times if someone wants play")
             leaderboard[player].badges.append(badge)
 
-    if crawl_count := compute_zero_score_count(games_sorted, prior_game_count, "loss"):
+    crawl_count = Counter({p: s.zero_loss_count for p, s in stats.items() if s.zero_loss_count})
+    if crawl_count:
         player, count = sorted(
             crawl_count.most_common(5),
             key=lambda x: (x[1], leaderboard[x[0]].skill_all if x[0] in leaderboard else 0),
@@ -109,13 +102,13 @@ def build_leaderboard(
         badge = Badge("🩸", f"Knee Bleeder: Inspected the underside of the table {count} times")
         leaderboard[player].badges.append(badge)
 
-    if win_streak := compute_streak(games_sorted, "win"):
+    if win_streak := Counter({p: s.win_streak for p, s in stats.items()}):
         player, count = win_streak.most_common(1)[0]
         if count > 3:
             badge = Badge("🎢", f"Unstoppable: Won {count} times in a row")
             leaderboard[player].badges.append(badge)
 
-    if loss_streak := compute_streak(games_sorted, "loss"):
+    if loss_streak := Counter({p: s.loss_streak for p, s in stats.items()}):
         player, count = loss_streak.most_common(1)[0]
         if count > 3:
             badge = Badge(
@@ -128,22 +121,20 @@ def build_leaderboard(
 
 @get("/")
 async def get_leaderboard_page(
-    request: Request, db: sqlite3.Connection, now: datetime
+    request: Request, db: AsyncConnection, org: OrgId, now: datetime
 ) -> Template | Redirect:
     season = get_season(now)
-    query = "SELECT * FROM game WHERE timestamp < ? AND season = ? ORDER BY timestamp"
-    season_games = tuple(Game(*row) for row in db.execute(query, (now.timestamp(), season)))
+    stats = await db.run(query_stats, org, season)
 
-    if is_season_start(now) and (
-        not season_games or request.cookies.get("wuzzln-wrapped") != season
-    ):
+    if is_season_start(now) and (not stats or request.cookies.get("wuzzln-wrapped") != season):
         return Redirect("/wrapped")
 
-    pre_season_game_count = query_game_count(
-        db, season_games[0].timestamp if season_games else now.timestamp()
-    )
+    two_weeks_ago = (now - timedelta(weeks=2)).timestamp()
+    recent_game_count = await db.run(query_recent_game_count, org, season, two_weeks_ago)
 
-    player_name = dict(db.execute("SELECT id, name FROM player"))
-    leaderboard = build_leaderboard(season_games, player_name, pre_season_game_count, now)
+    player_name = await db.run(query_player_names, org)
+    cur_rat = await db.run(query_latest_rating, org, season, before=now.timestamp())
+    prev_rat = await db.run(query_previous_rating, org, cur_rat)
+    leaderboard = build_leaderboard(stats, recent_game_count, cur_rat, prev_rat, player_name)
 
     return Template("leaderboard.html", context={"leaderboard": leaderboard})
@@ -1,41 +1,67 @@
-import sqlite3
-from collections import Counter
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime
 from itertools import combinations
-from typing import Annotated, Iterable, Literal, Sequence
+from typing import Annotated, Literal, Mapping, Sequence
 
 import trueskill as ts
+from cachetools import LRUCache
 from litestar import get, post
 from litestar.contrib.htmx.response import HTMXTemplate
-from litestar.datastructures.state import State
 from litestar.enums import RequestEncodingType
 from litestar.params import Body
 from litestar.response import Template
 
 from wuzzln import toast
-from wuzzln.data import Game, Matchmaking, PlayerId, get_season
-from wuzzln.database import exists
-from wuzzln.matchmaking import build_random_teams, tabu_search, variety_2v2, win_probability
-from wuzzln.rating import get_latest_rating
+from wuzzln.data import Matchmaking, OrgId, PlayerId, Rating, get_season
+from wuzzln.database import (
+    AsyncConnection,
+    insert_matchmakings,
+    open_write_database,
+    query_latest_rating,
+    query_partner_count,
+    query_player_names,
+    query_rating_version,
+)
+from wuzzln.executor import run_cpu_bound
+from wuzzln.matchmaking import (
+    EXACT_SEARCH_MAX_PLAYERS,
+    Team,
+    build_random_teams,
+    exact_search,
+    matching_search,
+    multi_start_tabu_search,
+    partner_penalty,
+    variety_2v2,
+    win_probability,
+)
+from wuzzln.rating import predict_ratings
+
+# seconds to search for fair teams when there are too many players to try all assignments
+SEARCH_TIME_BUDGET = 1.0
+
+# suggested games by (sorted players, method, season, rating version) per org, an org's cache is
+# cleared when its games change
+matchmaking_cache: defaultdict[OrgId, LRUCache[tuple, list[tuple[Team[int], Team[int]]]]] = (
+    defaultdict(lambda: LRUCache(32))
+)
 
 
 @get("/matchmaking")
-async def get_matchmaking_page(db: sqlite3.Connection) -> Template:
-    player_name = dict(db.execute("SELECT id, name FROM player WHERE active = true"))
+async def get_matchmaking_page(db: AsyncConnection, org: OrgId) -> Template:
+    player_name = await db.run(query_player_names, org, active=True)
     return Template("matchmaking.html", context={"player_name": player_name})
 
 
 def get_latest_defense_offense(
-    games_sorted: tuple[Game, ...], players: Sequence[PlayerId]
+    latest_rating: Mapping[PlayerId, Rating], players: Sequence[PlayerId]
 ) -> tuple[list[ts.Rating], list[ts.Rating]]:
     """Get current rating of player.
 
-    :param games_sorted: sorted by timestamp ascending
+    :param latest_rating: latest rating of each player
     :param players: players to get rating from
     :return: defense, offense rating
     """
-    latest_rating = get_latest_rating(games_sorted)
     defense = [ts.Rating() for _ in range(len(players))]
     offense = [ts.Rating() for _ in range(len(players))]
     for i, p in enumerate(players):
@@ -49,72 +75,98 @@ def get_latest_defense_offense(
 @dataclass
 class MatchmakingTaskDTO:
     players: list[PlayerId]
-    method: Literal["fair", "random"]
+    method: Literal["fair", "random", "matching"]
     probability: Literal["on"] | None = None
 
 
-def get_partner_count(games: Iterable[Game]) -> Counter[tuple[PlayerId, PlayerId]]:
-    """Count how often two players played together.
+async def find_games(
+    method: Literal["fair", "random", "matching"],
+    defense: Sequence[ts.Rating],
+    offense: Sequence[ts.Rating],
+    partner_count: Mapping[Team[int], int],
+) -> list[tuple[Team[int], Team[int]]]:
+    """Suggest games between players.
 
-    :param games: games to count from
-    :return: played pair mapping to number of games
+    :param method: matchmaking method
+    :param defense: defense ratings for all players (n)
+    :param offense: offense ratings for all players (n)
+    :param partner_count: how often two players played together as (defense, offense)
+    :return: games between two teams with players named by their index in `defense` and `offense`
     """
-    return Counter(
-        pair
-        for g in games
-        for pair in [
-            (g.defense_a, g.offense_a),
-            (g.defense_b, g.offense_b),
-        ]
-    )
+    n = len(defense)
+    match method:
+        case "random":
+            teams = build_random_teams(tuple(range(n)))
+        case "fair":
+            if n == 4:
+                teams = variety_2v2(defense, offense, partner_count)
+            elif n <= EXACT_SEARCH_MAX_PLAYERS:
+                penalty = partner_penalty(partner_count, n)
+                teams = (await run_cpu_bound(exact_search, defense, offense, 1, penalty))[0]
+            else:
+                # TODO: remove multiple returns
+                solutions = await run_cpu_bound(
+                    multi_start_tabu_search,
+                    defense,
+                    offense,
+                    k=1,
+                    time_budget=SEARCH_TIME_BUDGET,
+                    penalty=partner_penalty(partner_count, n),
+                )
+                teams = solutions[0]
+        case "matching":
+            # one game per team instead of every team against every other
+            penalty = partner_penalty(partner_count, n)
+            return await run_cpu_bound(matching_search, defense, offense, penalty)
+
+    return list(combinations(teams, 2))
 
 
 @post("/api/matchmaking/create")
 async def post_matchmaking(
     data: Annotated[MatchmakingTaskDTO, Body(media_type=RequestEncodingType.URL_ENCODED)],
-    db: sqlite3.Connection,
-    state: State,
+    db: AsyncConnection,
+    org: OrgId,
     now: datetime,
 ) -> Template:
-    players = data.players
+    player_name = await db.run(query_player_names, org)
+    # sorted so that player indices are the same for the same players
+    players = sorted(data.players)
     if len(players) < 2:
         return toast.error("At least 2 players necessary")
     elif len(players) % 2 != 0:
         return toast.error("Only even number of players supported")
     elif len(set(players)) != len(players):
         return toast.error("No duplicate players allowed")
-    elif any(not exists(db, "player", "id", p) for p in players):
+    elif not all(p in player_name for p in players):
         return toast.error("Unknown player")
 
-    query = "SELECT * FROM game WHERE season = ? ORDER BY timestamp"
-    season_games = tuple(Game(*row) for row in db.execute(query, (get_season(now),)))
-    defense, offense = get_latest_defense_offense(season_games, players)
-
-    match data.method:
-        case "random":
-            player_idx = tuple(range(len(players)))
-            teams = build_random_teams(player_idx)
-        case "fair":
-            if len(players) == 4:
-                player_idx = {p: i for i, p in enumerate(players)}
-                partner_count = {
-                    (player_idx[p1], player_idx[p2]): count
-                    for (p1, p2), count in get_partner_count(season_games).items()
-                    if p1 in player_idx and p2 in player_idx
-                }
-                teams = variety_2v2(defense, offense, partner_count)
-            else:
-                # TODO: remove multiple returns
-                teams = tabu_search(defense, offense, k=1)[0]
+    season = get_season(now)
+    latest_rating = await db.run(query_latest_rating, org, season, players)
+    defense, offense = get_latest_defense_offense(latest_rating, players)
+
+    # same players get the same suggestion until ratings change
+    key = (tuple(players), data.method, season, await db.run(query_rating_version, org, season))
+    if (games := matchmaking_cache[org].get(key)) is None:
+        partner_count: dict[Team[int], int] = {}
+        if data.method != "random":
+            player_idx = {p: i for i, p in enumerate(players)}
+            counts = await db.run(query_partner_count, org, season, players)
+            partner_count = {
+                (player_idx[p1], player_idx[p2]): count for (p1, p2), count in counts.items()
+            }
+        games = await find_games(data.method, defense, offense, partner_count)
+        # random should stay random
+        if data.method != "random":
+            matchmaking_cache[org][key] = games
 
     # build matchups
     matchmakings = set()
-    for (def_a, off_a), (def_b, off_b) in combinations(teams, 2):
+    for (def_a, off_a), (def_b, off_b) in games:
         win_prob = win_probability(
             (defense[def_a], offense[off_a]), (defense[def_b], offense[off_b])
         )
 
-        # TODO: add whether this is a rank up game
         m = Matchmaking(
             now.timestamp(),
             players[def_a],
@@ -126,19 +178,25 @@ async def post_matchmaking(
         )
         matchmakings.add(m)
 
-    # prevent spamming matchmaking button ovewriting list
-    existing_matchmakings = {m._replace(timestamp=0) for m in state.matchmakings}
-    for m in matchmakings:
-        if m._replace(timestamp=0) not in existing_matchmakings:
-            state.matchmakings.appendleft(m)
+    # players who reach the next rank if they win
+    matchups = [(m.defense_a, m.offense_a, m.defense_b, m.offense_b) for m in matchmakings]
+    prospects = predict_ratings(latest_rating, matchups, season, now.timestamp())
+    rank_ups = {
+        m: {p for p, prospect in ps.items() if prospect.rank_up}
+        for m, ps in zip(matchmakings, prospects)
+    }
 
-    player_name = dict(db.execute("SELECT id, name FROM player"))
+    # stores suggested matchups, the search above only needs a read connection
+    async with open_write_database() as write_db:
+        await write_db.run(insert_matchmakings, org, matchmakings, now.timestamp())
+        await write_db.commit()
 
     return HTMXTemplate(
         template_name="matchmaking_fragment.html",
         context={
             "player_name": player_name,
             "matchmakings": matchmakings,
+            "rank_ups": rank_ups,
             "show_probability": data.probability == "on",
         },
     )
@@ -1,16 +1,13 @@
-import sqlite3
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Mapping
 
 from litestar import get
 from litestar.exceptions import NotFoundException
 from litestar.response.template import Template
 
-from wuzzln.data import Game, PlayerId, get_season
-from wuzzln.database import exists
-from wuzzln.rating import get_latest_rating, get_rank
-from wuzzln.statistics import compute_game_count, compute_zero_score_count
+from wuzzln.data import Game, OrgId, PlayerId, PlayerStats, get_season
+from wuzzln.database import AsyncConnection, query_latest_rating, query_player_games
+from wuzzln.rating import get_rank
 
 
 @dataclass
@@ -29,21 +26,14 @@ class Challenge:
         self.percentage = int(100 * (self.absolute / goal))
 
 
-def get_awards(
-    player: PlayerId, games_sorted: tuple[Game, ...], prior_game_count: Mapping[PlayerId, int]
-):
-    season_game_count = compute_game_count(games_sorted).get(player, 0)
-    total_game_count = prior_game_count.get(player, 0) + season_game_count
-    zero_wins = compute_zero_score_count(games_sorted, prior_game_count, mode="win").get(player, 0)
-    zero_losses = compute_zero_score_count(games_sorted, prior_game_count, mode="loss").get(
-        player, 0
-    )
+def get_awards(stats: PlayerStats):
+    total_game_count = stats.prior_game_count + stats.game_count
 
     return [
-        Award("🧗", "Season Games", f"{season_game_count:,d}"),
+        Award("🧗", "Season Games", f"{stats.game_count:,d}"),
         Award("⚽️", "Total Games", f"{total_game_count:,d}"),
-        Award("🦅", "Let others crawl", f"{zero_wins:,d}"),
-        Award("🩸", "Crawled", f"{zero_losses:,d}"),
+        Award("🦅", "Let others crawl", f"{stats.zero_win_count:,d}"),
+        Award("🩸", "Crawled", f"{stats.zero_loss_count:,d}"),
     ]
 
 
@@ -84,27 +74,24 @@ def get_season_challenges(player: PlayerId, games_sorted: tuple[Game, ...]):
 
 
 @get("/player/{id: str}")
-async def get_player_page(id: PlayerId, db: sqlite3.Connection, now: datetime) -> Template:
+async def get_player_page(id: PlayerId, db: AsyncConnection, org: OrgId, now: datetime) -> Template:
     player = id
-    if not exists(db, "player", "id", player):
+    query = "SELECT name FROM player WHERE id = ? AND org = ?"
+    if (row := await db.fetchone(query, (player, org))) is None:
         raise NotFoundException("Player does not exist")
-    player_name = db.execute("SELECT name FROM player WHERE id = ?", (player,)).fetchone()[0]
+    (player_name,) = row
 
     season = get_season(now)
-    games = tuple(
-        Game(*r)
-        for r in db.execute("SELECT * FROM game WHERE season = ? ORDER BY timestamp", (season,))
-    )
+    games = tuple(await db.run(query_player_games, player, season))
 
     cur_defense = 0
     cur_offense = 0
     cur_rank = get_rank(0)
-    if r := get_latest_rating(games).get(player):
+    if r := (await db.run(query_latest_rating, org, season, players=[player])).get(player):
         cur_defense = r.defense
         cur_offense = r.offense
         cur_rank = get_rank(r.overall)
 
-    # prior_game_count = query_game_count(db, games[0].timestamp if games else now.timestamp())
     challenges = get_season_challenges(player, games)
 
     return Template(
@@ -1,4 +1,3 @@
-import sqlite3
 from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime
@@ -10,14 +9,12 @@ from litestar.datastructures import Cookie
 from litestar.exceptions import NotFoundException
 from litestar.response import Template
 
-from wuzzln.data import Game, PlayerId, get_season
-from wuzzln.database import query_game_count
-from wuzzln.rating import compute_ratings, get_latest_rating
-from wuzzln.statistics import (
-    compute_1v1_count,
-    compute_game_count,
-    compute_unique_people_count,
-    compute_zero_score_count,
+from wuzzln.data import OrgId, PlayerId, PlayerStats, Rating, get_season
+from wuzzln.database import (
+    AsyncConnection,
+    query_latest_rating,
+    query_player_names,
+    query_stats,
 )
 
 
@@ -45,19 +42,16 @@ class Award:
 
 
 def compute_kpis(
-    games: tuple[Game, ...],
-    prev_games: tuple[Game, ...],
-    prior_game_count: Counter[PlayerId],
-    prior_prev_game_count: Counter[PlayerId],
+    stats: Mapping[PlayerId, PlayerStats], prev_stats: Mapping[PlayerId, PlayerStats]
 ) -> list[Kpi]:
     kpis = []
 
-    def get_work_days(games):
-        num_players = sum(len({g.defense_a, g.offense_a, g.defense_b, g.offense_b}) for g in games)
+    def get_work_days(stats):
+        num_players = sum(s.game_count for s in stats.values())
         return (num_players * 10) / (60 * 8)
 
-    work_days = get_work_days(games)
-    prev_work_days = get_work_days(prev_games)
+    work_days = get_work_days(stats)
+    prev_work_days = get_work_days(prev_stats)
     kpis.append(
         Kpi(
             "Total time played (days)*",
@@ -67,11 +61,8 @@ def compute_kpis(
         )
     )
 
-    def get_unique_player_count(games):
-        return len({p for g in games for p in {g.defense_a, g.offense_b, g.defense_b, g.offense_b}})
-
-    player_count = get_unique_player_count(games)
-    prev_player_count = get_unique_player_count(prev_games)
+    player_count = len(stats)
+    prev_player_count = len(prev_stats)
     kpis.append(
         Kpi(
             "Total players",
@@ -89,10 +80,8 @@ def compute_kpis(
         )
     )
 
-    crawl_count = sum(compute_zero_score_count(games, prior_game_count, "loss").values())
-    prev_crawl_count = sum(
-        compute_zero_score_count(prev_games, prior_prev_game_count, "loss").values()
-    )
+    crawl_count = sum(s.zero_loss_count for s in stats.values())
+    prev_crawl_count = sum(s.zero_loss_count for s in prev_stats.values())
     kpis.append(
         Kpi(
             "Table underside inspections",
@@ -122,56 +111,58 @@ def get_top_counts[K](counter: Counter[K], k=2) -> tuple[int, list[K]]:
 
 
 def compute_player_awards(
-    games_sorted: tuple[Game, ...],
-    prev_games_sorted: tuple[Game, ...],
-    prior_game_count: Mapping[PlayerId, int],
+    stats: Mapping[PlayerId, PlayerStats],
+    prev_stats: Mapping[PlayerId, PlayerStats],
+    latest_rating: Mapping[PlayerId, Rating],
+    prev_latest_rating: Mapping[PlayerId, Rating],
 ) -> list[Award]:
     """Get all awards that relate to the game scores
 
-    :param games_sorted: games from season
-    :param prev_games_sorted: games from previous season
-    :param prior_game_count: games each player played prior to the current games
+    :param stats: statistics of each player in the season
+    :param prev_stats: statistics of each player in the previous season
+    :param latest_rating: rating of each player at the end of the season
+    :param prev_latest_rating: rating of each player at the end of the previous season
     :return: list of awards
     """
+
+    def counts(field: str) -> Counter[PlayerId]:
+        return Counter({p: n for p, s in stats.items() if (n := getattr(s, field))})
+
     awards = []
-    if game_count := compute_game_count(games_sorted):
+    if game_count := counts("game_count"):
         count, players = get_top_counts(game_count)
         awards.append(Award("🧗", "Going Pro", f"Played {count:,d} games", players))
 
-    if unique_people_count := compute_unique_people_count(games_sorted):
+    if unique_people_count := counts("people_count"):
         count, players = get_top_counts(unique_people_count)
         awards.append(Award("🌍", "Globalist", f"Played with {count:,d} different people", players))
 
-    if one_v_ones := compute_1v1_count(games_sorted):
+    if one_v_ones := counts("one_vs_one_count"):
         count, players = get_top_counts(one_v_ones)
         awards.append(Award("🐺", "Lonewolf", f"Played {count:,d} 1v1s", players))
 
-    if crawl_count := compute_zero_score_count(games_sorted, prior_game_count, "loss"):
+    if crawl_count := counts("zero_loss_count"):
         count, players = get_top_counts(crawl_count)
         awards.append(
             Award("🩸", "Knee Bleeder", f"Crawled {count:,d} times under the table", players)
         )
 
-    if reverse_crawl_count := compute_zero_score_count(games_sorted, prior_game_count, "win"):
+    if reverse_crawl_count := counts("zero_win_count"):
         count, players = get_top_counts(reverse_crawl_count)
         awards.append(Award("🦅", "Opportunist", f"Let others crawl {count:,d} times", players))
 
-    if games_sorted:
-        rating = {}
-        prev_rating = {}
-        for r in reversed(compute_ratings(games_sorted)):
-            if r.player not in rating:
-                rating[r.player] = r.overall
-        for r in reversed(compute_ratings(prev_games_sorted)):
-            if r.player not in prev_rating:
-                prev_rating[r.player] = r.overall
-
-        game_count = compute_game_count(prev_games_sorted)
-        prev_game_count = compute_game_count(prev_games_sorted)
+    if stats:
+        rating = {p: r.overall for p, r in latest_rating.items()}
+        prev_rating = {p: r.overall for p, r in prev_latest_rating.items()}
+
         rating_diff = [
             (rating[p] - prev_rating[p], p)
             for p in rating.keys()
-            if p in prev_rating and game_count[p] >= 5 and prev_game_count[p] >= 5
+            if p in prev_rating
+            and p in stats
+            and p in prev_stats
+            and stats[p].game_count >= 5
+            and prev_stats[p].game_count >= 5
         ]
         if rating_diff:
             diff, player = max(rating_diff)
@@ -187,41 +178,28 @@ def compute_player_awards(
 
 
 @get("/wrapped")
-async def get_wrapped_page(db: sqlite3.Connection, now: datetime) -> Template:
-    query = "SELECT * FROM game WHERE season = ? ORDER BY timestamp"
-    last_season_games = tuple(Game(*row) for row in db.execute(query, (get_season(now, -1),)))
-    llast_season_games = tuple(Game(*row) for row in db.execute(query, (get_season(now, -2),)))
+async def get_wrapped_page(db: AsyncConnection, org: OrgId, now: datetime) -> Template:
+    last_season = get_season(now, -1)
+    last_stats = await db.run(query_stats, org, last_season)
+    llast_stats = await db.run(query_stats, org, get_season(now, -2))
 
-    if not last_season_games:
+    if not last_stats:
         raise NotFoundException("There were no games played in this time period")
 
-    pre_last_season_game_count = query_game_count(db, last_season_games[0].timestamp)
-    pre_llast_season_game_count = (
-        query_game_count(db, llast_season_games[0].timestamp) if llast_season_games else Counter()
-    )
-    awards = compute_player_awards(
-        last_season_games, llast_season_games, pre_last_season_game_count
-    )
-
-    kpis = compute_kpis(
-        last_season_games,
-        llast_season_games,
-        pre_last_season_game_count,
-        pre_llast_season_game_count,
-    )
+    last_rating = await db.run(query_latest_rating, org, last_season)
+    llast_rating = await db.run(query_latest_rating, org, get_season(now, -2))
+    awards = compute_player_awards(last_stats, llast_stats, last_rating, llast_rating)
+    kpis = compute_kpis(last_stats, llast_stats)
 
     # TODO: add awards to player page
 
-    last_rating = get_latest_rating(last_season_games)
     top_3 = sorted(last_rating.items(), key=lambda x: x[1].overall, reverse=True)[:3]
     placing = [Placing(p, r.defense, r.offense) for p, r in top_3]
 
-    player_name = dict(db.execute("SELECT id, name FROM player"))
-    row = db.execute(
-        "SELECT count(distinct season) FROM game WHERE timestamp <= ?",
-        (last_season_games[0].timestamp,),
-    ).fetchone()
-    season_count = row[0] if row else 0
+    player_name = await db.run(query_player_names, org)
+    # season ids sort by time
+    query = "SELECT count(DISTINCT season) FROM player_stats WHERE org = ? AND season <= ?"
+    (season_count,) = await db.fetchone(query, (org, last_season))
 
     return Template(
         "wrapped.html",
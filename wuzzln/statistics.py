@@ -2,7 +2,7 @@ import operator
 from collections import Counter, defaultdict
 from typing import Iterable, Literal, Mapping
 
-from wuzzln.data import Game, PlayerId
+from wuzzln.data import Game, PlayerId, PlayerStats
 
 
 def compute_zero_score_count(
@@ -105,3 +105,78 @@ def compute_streak(games_sorted: Iterable[Game], mode: Literal["win", "loss"]) -
         add({g.defense_b, g.offense_b}, cmp(g.score_b, g.score_a))
 
     return Counter(win_streak)
+
+
+class StatsState:
+    """Statistics of each player in a season which can be advanced one game at a time.
+
+    Gives the same counts as the `compute_*` functions above, but only the players of a new game
+    are touched, so they can be stored and updated whenever a game is added.
+    """
+
+    def __init__(
+        self,
+        latest: Mapping[PlayerId, PlayerStats] | None = None,
+        people: Mapping[PlayerId, set[PlayerId]] | None = None,
+        prior_game_count: Mapping[PlayerId, int] | None = None,
+        min_game_count: int = 25,
+    ) -> None:
+        """Create statistics state.
+
+        :param latest: statistics of each player to continue from, defaults to new season
+        :param people: people each player played with so far
+        :param prior_game_count: games played before the season by players without statistics
+        :param min_game_count: minimum number of games until zero scores are counted
+        """
+        self.latest: dict[PlayerId, PlayerStats] = dict(latest or {})
+        self.people: defaultdict[PlayerId, set[PlayerId]] = defaultdict(set, people or {})
+        self.prior_game_count = prior_game_count or {}
+        self.min_game_count = min_game_count
+
+    def update(self, game: Game) -> list[PlayerStats]:
+        """Advance statistics of the players in a game.
+
+        :param game: game played after all games seen so far
+        :return: new statistics of the players in the game
+        """
+        g = game
+        team_a = {g.defense_a, g.offense_a}
+        team_b = {g.defense_b, g.offense_b}
+        players = team_a | team_b
+        is_zero_game = g.score_a == 0 or g.score_b == 0
+        is_1v1 = len(team_a) == len(team_b) == 1 and team_a != team_b
+
+        before = {
+            p: self.latest.get(p) or PlayerStats(g.season, p, self.prior_game_count.get(p, 0))
+            for p in players
+        }
+        experienced = {
+            p: s.prior_game_count + s.game_count >= self.min_game_count for p, s in before.items()
+        }
+
+        stats = []
+        for team, other_team, score, other_score in [
+            (team_a, team_b, g.score_a, g.score_b),
+            (team_b, team_a, g.score_b, g.score_a),
+        ]:
+            zero_win = is_zero_game and score > 0 and all(experienced[p] for p in other_team)
+            zero_loss = is_zero_game and score == 0 and all(experienced[p] for p in team)
+            won = score > other_score
+            lost = score < other_score
+            for p in team:
+                self.people[p] |= players
+                s = before[p]
+                stats.append(
+                    s._replace(
+                        game_count=s.game_count + 1,
+                        one_vs_one_count=s.one_vs_one_count + is_1v1,
+                        zero_win_count=s.zero_win_count + zero_win,
+                        zero_loss_count=s.zero_loss_count + zero_loss,
+                        win_streak=(s.win_streak + won) * won,
+                        loss_streak=(s.loss_streak + lost) * lost,
+                        people_count=len(self.people[p]),
+                    )
+                )
+
+        self.latest.update((s.player, s) for s in stats)
+        return stats
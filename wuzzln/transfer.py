@@ -0,0 +1,166 @@
+import csv
+import json
+import sqlite3
+from datetime import datetime
+from itertools import batched
+from typing import IO, Iterable, Iterator, Literal
+
+from wuzzln.data import Game, OrgId, SeasonId, get_season, validate_game
+from wuzzln.database import insert_many, query_partitions, rebuild_ratings, rebuild_stats
+
+type Format = Literal["csv", "jsonl"]
+
+# games inserted with one executemany, bounds memory use of an import
+IMPORT_BATCH_SIZE = 10_000
+
+
+def parse_game(row: dict[str, str | int | float]) -> Game:
+    """Convert a row of a csv or json-lines file to a game.
+
+    :param row: field name to value mapping
+    :return: game
+    :raise ValueError: if a field is missing or has the wrong type
+    """
+    if any(value is None for value in row.values()):
+        raise ValueError("Missing value")
+    try:
+        return Game(
+            id=str(row["id"]),
+            timestamp=float(row["timestamp"]),
+            org=str(row["org"]),
+            season=str(row["season"]),
+            defense_a=str(row["defense_a"]),
+            offense_a=str(row["offense_a"]),
+            defense_b=str(row["defense_b"]),
+            offense_b=str(row["offense_b"]),
+            score_a=int(row["score_a"]),
+            score_b=int(row["score_b"]),
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing field {e}") from None
+    except TypeError as e:
+        raise ValueError(f"Wrong type: {e}") from None
+
+
+def read_games(file: IO[str], format: Format) -> Iterator[Game]:
+    """Read games one at a time.
+
+    Games are checked like games added in the web UI, their season must be the one of their
+    timestamp. Blank lines of json-lines files are skipped.
+
+    :param file: csv file with header or json-lines file, both with the fields of `Game`
+    :param format: file format
+    :return: games in file order
+    :raise ValueError: if a row is not a valid game
+    """
+    rows = csv.DictReader(file) if format == "csv" else (line for line in file if line.strip())
+    for i, row in enumerate(rows, 1):
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError("Not a JSON object")
+            game = parse_game(row)
+        except ValueError as e:
+            raise ValueError(f"Game {i}: {e}") from None
+        if error := validate_game(game):
+            raise ValueError(f"Game {i}: {error}")
+        if game.season != (season := get_season(datetime.fromtimestamp(game.timestamp))):
+            raise ValueError(f"Game {i}: Season {game.season} does not match timestamp ({season})")
+        yield game
+
+
+def write_games(file: IO[str], games: Iterable[Game], format: Format) -> int:
+    """Write games one at a time.
+
+    :param file: file to write to
+    :param games: some games
+    :param format: file format
+    :return: number of games written
+    """
+    count = 0
+    if format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(Game._fields)
+        for g in games:
+            writer.writerow(g)
+            count += 1
+    else:
+        for g in games:
+            file.write(json.dumps(g._asdict()) + "\n")
+            count += 1
+    return count
+
+
+def export_games(
+    db: sqlite3.Connection, seasons: Iterable[SeasonId] | None = None
+) -> Iterator[Game]:
+    """Read games from the database without loading all of them at once.
+
+    :param db: game database
+    :param seasons: only export these seasons, defaults to all seasons
+    :return: games sorted by season and time
+    """
+    query = "SELECT * FROM game"
+    params: list[SeasonId] = []
+    if seasons is not None:
+        params = list(seasons)
+        query += f" WHERE season IN ({','.join('?' for _ in params)})"
+    query += " ORDER BY season, timestamp"
+    return (Game(*row) for row in db.execute(query, params))
+
+
+def import_games(
+    db: sqlite3.Connection, games: Iterable[Game], batch_size: int = IMPORT_BATCH_SIZE
+) -> int:
+    """Insert games in batches and rebuild ratings and statistics of their seasons.
+
+    Everything happens in one transaction, so nothing is imported if any game is invalid.
+
+    :param db: game database
+    :param games: valid games e.g. from :func:`read_games`
+    :param batch_size: number of games per insert
+    :return: number of imported games
+    :raise ValueError: if a player of a game does not exist or belongs to another org, or if two
+        games of a season have the same timestamp
+    :raise sqlite3.IntegrityError: if a game already exists
+    """
+    player_org = dict(db.execute("SELECT id, org FROM player"))
+    partitions: set[tuple[OrgId, SeasonId]] = set()
+    count = 0
+    try:
+        for batch in batched(games, batch_size):
+            for i, g in enumerate(batch, count + 1):
+                players = {g.defense_a, g.offense_a, g.defense_b, g.offense_b}
+                if unknown := players - player_org.keys():
+                    raise ValueError(f"Game {i}: Unknown player {', '.join(sorted(unknown))}")
+                if other := {p for p in players if player_org[p] != g.org}:
+                    raise ValueError(f"Game {i}: Player {', '.join(sorted(other))} not in {g.org}")
+                partitions.add((g.org, g.season))
+            insert_many(db, batch)
+            count += len(batch)
+
+        # ratings and their checkpoints are ordered by timestamp, ties would be rated out of order
+        query = """
+            SELECT timestamp FROM game WHERE org = ? AND season = ?
+            GROUP BY timestamp HAVING count(*) > 1 LIMIT 1
+        """
+        for org, season in sorted(partitions):
+            if tie := db.execute(query, (org, season)).fetchone():
+                raise ValueError(f"Several games of {org} in {season} at timestamp {tie[0]}")
+
+        # one season at a time, so memory use is bounded by the largest season
+        for org, season in sorted(partitions):
+            rebuild_ratings(db, org, season)
+        # statistics depend on the games of earlier seasons, ratings don't
+        first_season = {}
+        for org, season in partitions:
+            first_season[org] = min(season, first_season.get(org, season))
+        for org, season in query_partitions(db, orgs=first_season):
+            if season >= first_season[org]:
+                rebuild_stats(db, org, season)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return count